@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from . import idempotency, routers
+from .authentication import expiry_cutoff, live_tokens
+from .models import User
+from .refcodes import allocator
+
+
+def log_in(phone):
+    """
+    Return the token key of the user of a phone number and whether the
+    user was created, creating the user and the token when missing.
+
+    The user and the token are written with INSERT ... ON CONFLICT, so
+    concurrent first logins of a number end with one user and one token,
+    and nothing is read before the writes. The user was created by this
+    call when its date_joined is the one written here. A new user reads
+    from the primary for a while, like after other writes.
+    """
+    now = timezone.now()
+    for _ in range(settings.REF_CODE_RETRIES):
+        user = User(username=phone, ref=allocator.next_code(), last_login=now, date_joined=now)
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(
+                    [user],
+                    update_conflicts=True,
+                    unique_fields=["username"],
+                    update_fields=["last_login"],
+                )
+                if user.pk is None:
+                    # Backends that cannot return rows from an upsert.
+                    user.pk = User.objects.filter(username=phone).values_list(
+                        "pk", flat=True
+                    ).get()
+                Token.objects.bulk_create(
+                    [Token(key=Token.generate_key(), user_id=user.pk)], ignore_conflicts=True
+                )
+                key, date_joined, refreshed = Token.objects.filter(
+                    user_id=user.pk
+                ).values_list("key", "user__date_joined", "created").get()
+                cutoff = expiry_cutoff()
+                if cutoff is not None and refreshed <= cutoff:
+                    # An expired token is replaced rather than revived.
+                    Token.objects.filter(key=key).delete()
+                    key = Token.objects.create(user_id=user.pk).key
+        except IntegrityError:
+            # As in User.save(), a code issued before the allocator
+            # existed may clash with an allocated one and is skipped.
+            if not User.objects.filter(ref=user.ref).exists():
+                raise
+            continue
+        created = date_joined == now
+        if created:
+            routers.pin(user.pk)
+        return key, created
+    raise IntegrityError("Could not allocate a unique referral code.")
+
+
+def rotate(token):
+    """
+    Replace a token with a new one for the same user and return its key,
+    or None when the token was already replaced or deleted.
+    """
+    with transaction.atomic():
+        deleted, _ = Token.objects.filter(key=token.key).delete()
+        if not deleted:
+            return None
+        return Token.objects.create(user_id=token.user_id).key
+
+
+def replay_token(phone, fingerprint):
+    """
+    Return the token key of the user of a phone number if it is still the
+    live token the fingerprint was taken of.
+
+    A replayed login response thus never hands out a token that was
+    rotated or expired since.
+    """
+    key = live_tokens().filter(user__username=phone).values_list("key", flat=True).first()
+    if key is not None and idempotency.fingerprint(key) == fingerprint:
+        return key
+    return None
+
+
+async def areplay_token(phone, fingerprint):
+    key = await live_tokens().filter(user__username=phone).values_list("key", flat=True).afirst()
+    if key is not None and idempotency.fingerprint(key) == fingerprint:
+        return key
+    return None
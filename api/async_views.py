@@ -0,0 +1,278 @@
+import json, math, random
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from . import accounts, events, idempotency, otp, profiles, referrals, routers, throttling
+from .authentication import arefresh, get_token_cache, is_expired, live_tokens, needs_refresh
+from .delivery import get_backend
+from .models import User
+from .views import ACTIVATION_ERRORS
+
+
+# Async counterparts of the views in views.py for running under ASGI.
+# They accept and return the same JSON as the DRF views.
+
+def parse_body(request):
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            return {}
+    return request.POST
+
+
+async def authenticate(request):
+    """
+    Resolve the user of a "Token <key>" Authorization header.
+    """
+    header = request.headers.get("Authorization", "").split()
+    if len(header) != 2 or header[0].lower() != "token":
+        return None
+    key = header[1]
+    token = await get_token_cache().aget(key)
+    if token is None or is_expired(token):
+        try:
+            token = await live_tokens().select_related("user").aget(key=key)
+        except Token.DoesNotExist:
+            return None
+        if not token.user.is_active:
+            return None
+        await get_token_cache().aset(key, token)
+    if needs_refresh(token):
+        await arefresh(token)
+        await get_token_cache().aset(key, token)
+    return token.user
+
+
+async def throttle(scope, request, data):
+    """
+    Apply the IP and phone throttles of the sync views to the request.
+    """
+    for kind, ident in (
+        ("ip", throttling.ip_ident(request)),
+        ("phone", throttling.phone_ident(data)),
+    ):
+        wait = await throttling.acheck(f"{scope}-{kind}", ident)
+        if wait is not None:
+            wait = math.ceil(wait)
+            return JsonResponse(
+                {"detail": f"Request was throttled. Expected available in {wait} seconds."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(wait)}
+            )
+    return None
+
+
+def unauthorized():
+    return JsonResponse(
+        {"detail": "Invalid token."}, status=status.HTTP_401_UNAUTHORIZED
+    )
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncLoginView(View):
+    """
+    Log in using phone number and receive a verification code.
+    """
+
+    async def post(self, request):
+        body = parse_body(request)
+        throttled = await throttle("login", request, body)
+        if throttled is not None:
+            return throttled
+        input_phone = body.get("phone") or ""
+        phone = "".join(filter(str.isdigit, input_phone))
+        if len(phone) != 11:
+            return JsonResponse(
+                {"message": "Phone number must have exactly 11 digits."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        code = str(random.randint(1, 9999)).zfill(4)
+        await otp.get_store().aissue(phone, code)
+        ticket = await get_backend().asubmit(phone, code)
+        data = {
+            "phone": phone,
+            "ticket": ticket
+        }
+        if settings.OTP_EXPOSE_CODE:
+            data["code"] = code
+        return JsonResponse(data, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncVerifyView(View):
+    """
+    Verify the phone number using the received code.
+    """
+
+    async def post(self, request):
+        body = parse_body(request)
+        throttled = await throttle("verify", request, body)
+        if throttled is not None:
+            return throttled
+        phone_num = "".join(filter(str.isdigit, body.get("phone") or ""))
+        if len(phone_num) != 11:
+            return JsonResponse(
+                {"message": "Invalid code."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        result = await otp.get_store().averify(phone_num, body.get("verify"))
+        replay_key = idempotency.make_key("verify", request, phone_num, body.get("verify"))
+        if result == otp.MISSING:
+            replay = await idempotency.alookup(replay_key)
+            token = replay and await accounts.areplay_token(phone_num, replay[0]["token"])
+            if token:
+                data, status_code = replay
+                return JsonResponse(
+                    {**data, "token": token}, status=status_code,
+                    headers={idempotency.REPLAYED_HEADER: "true"}
+                )
+        if result == otp.EXPIRED:
+            return JsonResponse(
+                {"message": "Code expired."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if result == otp.LOCKED:
+            return JsonResponse(
+                {"message": "Too many attempts. Request a new code."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+        if result != otp.VALID:
+            return JsonResponse(
+                {"message": "Invalid code."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        token, created = await sync_to_async(accounts.log_in)(phone_num)
+        if created:
+            message, status_code = "User created and logged in.", status.HTTP_201_CREATED
+        else:
+            message, status_code = "Login successful.", status.HTTP_200_OK
+        await idempotency.aremember(
+            replay_key, {"message": message, "token": idempotency.fingerprint(token)}, status_code
+        )
+        return JsonResponse({"message": message, "token": token}, status=status_code)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncDataView(View):
+    """
+    View and manage user data.
+    """
+
+    async def get(self, request):
+        user_instance = await authenticate(request)
+        if user_instance is None:
+            return unauthorized()
+        if settings.DATABASE_REPLICAS and not await sync_to_async(routers.is_pinned)(
+            user_instance.pk
+        ):
+            with routers.use_replicas():
+                return await self.read(request, user_instance)
+        return await self.read(request, user_instance)
+
+    async def read(self, request, user_instance):
+        invited_value = user_instance.inviter_id or ""
+        ref_value = user_instance.ref
+        invited_users = User.objects.filter(
+            inviter_id=ref_value
+        ).order_by("username").values_list("username", flat=True)
+        if request.GET.get("count_only") in ("1", "true"):
+            data = {
+                "ref": ref_value,
+                "invited": invited_value,
+                "count": user_instance.invitee_count
+            }
+            return JsonResponse(data, status=status.HTTP_200_OK)
+        if request.GET.get("stream") in ("1", "true"):
+            # The stream is read after the view returns, outside the
+            # replica routing, so its database is fixed here.
+            invited_users = invited_users.using(invited_users.db)
+            async def lines():
+                async for username in invited_users.aiterator(chunk_size=2000):
+                    yield json.dumps(username) + "\n"
+            return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
+        try:
+            limit = int(request.GET.get("limit", settings.DATA_PAGE_SIZE))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= settings.DATA_MAX_PAGE_SIZE:
+            return JsonResponse(
+                {"message": f"Limit must be between 1 and {settings.DATA_MAX_PAGE_SIZE}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        after = request.GET.get("after")
+        cache_key = await sync_to_async(profiles.profile_key)(
+            user_instance.pk, f"{limit}:{after or ''}"
+        )
+        cached = await sync_to_async(profiles.get_profile)(cache_key)
+        if cached is None:
+            if after:
+                invited_users = invited_users.filter(username__gt=after)
+            invited_data = [i async for i in invited_users[:limit + 1]]
+            next_cursor = invited_data[limit - 1] if len(invited_data) > limit else None
+            cached = await sync_to_async(profiles.set_profile)(
+                cache_key, {"users": invited_data[:limit], "next": next_cursor}
+            )
+        data, etag = profiles.profile_data(user_instance, *cached)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = JsonResponse(data, status=status.HTTP_200_OK)
+        response["ETag"] = etag
+        return response
+
+    async def post(self, request):
+        user_instance = await authenticate(request)
+        if user_instance is None:
+            return unauthorized()
+        ref_code = parse_body(request).get("ref_code")
+        if not ref_code:
+            return JsonResponse(
+                {"message": "Referral code is required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        result = await sync_to_async(referrals.activate)(user_instance, ref_code)
+        if result != referrals.ACTIVATED:
+            message, status_code = ACTIVATION_ERRORS[result]
+            return JsonResponse({"message": message}, status=status_code)
+        data = {
+            "message": f"Referral code {ref_code} successfully registered.",
+            "invited": ref_code,
+        }
+        return JsonResponse(data, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncEventsView(View):
+    """
+    Read registered referrals in order, waiting without holding a thread.
+    """
+
+    async def get(self, request):
+        user_instance = await authenticate(request)
+        if user_instance is None:
+            return unauthorized()
+        if not user_instance.is_staff:
+            return JsonResponse(
+                {"detail": "You do not have permission to perform this action."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        params = events.parse_params(request.GET)
+        if isinstance(params, str):
+            return JsonResponse({"message": params}, status=status.HTTP_400_BAD_REQUEST)
+        after, limit, wait = params
+        if settings.DATABASE_REPLICAS:
+            with routers.use_replicas():
+                data = await events.apoll(after, limit, wait)
+        else:
+            data = await events.apoll(after, limit, wait)
+        return JsonResponse(
+            {"events": data, "next": data[-1]["id"] if data else after},
+            status=status.HTTP_200_OK
+        )
@@ -0,0 +1,194 @@
+import pickle, threading, time
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from .models import User
+
+
+class LocalTokenCache:
+    """
+    Bounded LRU cache with per-entry expiry, local to the process.
+
+    Entries are stored pickled, so every request gets its own copy of the
+    cached user.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return pickle.loads(entry[0])
+
+    def set(self, key, value):
+        entry = (pickle.dumps(value), time.monotonic() + self.ttl)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value):
+        self.set(key, value)
+
+
+class SharedTokenCache:
+    """
+    Token cache kept in a Django cache shared by all worker processes.
+    """
+
+    def __init__(self, alias, ttl):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.cache.get(f"auth-token:{key}")
+
+    def set(self, key, value):
+        self.cache.set(f"auth-token:{key}", value, self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(f"auth-token:{key}")
+
+    async def aget(self, key):
+        return await self.cache.aget(f"auth-token:{key}")
+
+    async def aset(self, key, value):
+        await self.cache.aset(f"auth-token:{key}", value, self.ttl)
+
+
+_cache = None
+
+
+def get_token_cache():
+    global _cache
+    if _cache is None:
+        if settings.TOKEN_CACHE_ALIAS:
+            _cache = SharedTokenCache(settings.TOKEN_CACHE_ALIAS, settings.TOKEN_CACHE_TTL)
+        else:
+            _cache = LocalTokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+    return _cache
+
+
+def invalidate_user(user_pk):
+    for key in Token.objects.filter(user_id=user_pk).values_list("key", flat=True):
+        get_token_cache().delete(key)
+
+
+# Token.created is the time of the last refresh. A token expires TOKEN_TTL
+# seconds after it, and using the token refreshes it at most once per
+# TOKEN_REFRESH_INTERVAL seconds.
+
+def expiry_cutoff():
+    """
+    Return the refresh time at or before which tokens are expired, or
+    None when tokens do not expire.
+    """
+    if settings.TOKEN_TTL is None:
+        return None
+    return timezone.now() - timedelta(seconds=settings.TOKEN_TTL)
+
+
+def live_tokens():
+    cutoff = expiry_cutoff()
+    if cutoff is None:
+        return Token.objects.all()
+    return Token.objects.filter(created__gt=cutoff)
+
+
+def is_expired(token):
+    cutoff = expiry_cutoff()
+    return cutoff is not None and token.created <= cutoff
+
+
+def needs_refresh(token):
+    return settings.TOKEN_TTL is not None and (
+        token.created <= timezone.now() - timedelta(seconds=settings.TOKEN_REFRESH_INTERVAL)
+    )
+
+
+def refresh(token):
+    # Of concurrent refreshes of a token only the first one writes.
+    now = timezone.now()
+    Token.objects.filter(key=token.key, created=token.created).update(created=now)
+    token.created = now
+
+
+async def arefresh(token):
+    now = timezone.now()
+    await Token.objects.filter(key=token.key, created=token.created).aupdate(created=now)
+    token.created = now
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that keeps recently used tokens together with
+    their users in a cache, so repeated requests skip the token and user
+    lookup.
+
+    The local cache is only invalidated in the process where a token or
+    user changes; other processes see the change after TOKEN_CACHE_TTL.
+    Set TOKEN_CACHE_ALIAS to share the cache between processes. Expired
+    tokens are rejected whether they are cached or not.
+    """
+
+    def authenticate_credentials(self, key):
+        token = get_token_cache().get(key)
+        if token is None or is_expired(token):
+            # The expiry is checked by the primary key lookup itself.
+            try:
+                token = live_tokens().select_related("user").get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_("Invalid token."))
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+            get_token_cache().set(key, token)
+        if needs_refresh(token):
+            refresh(token)
+            get_token_cache().set(key, token)
+        return token.user, token
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    get_token_cache().delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_user(instance.pk)
+
+
+@receiver(setting_changed)
+def reset_token_cache(setting, **kwargs):
+    global _cache
+    if setting.startswith("TOKEN_CACHE_"):
+        _cache = None
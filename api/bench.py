@@ -0,0 +1,70 @@
+import math
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import connection
+
+
+def require_dedicated_database(command, i_know):
+    """
+    Refuse to write generated users to a database that LOADTEST_DATABASE
+    does not mark as dedicated to load tests, unless --i-know was passed.
+    """
+    if settings.LOADTEST_DATABASE or i_know:
+        return
+    raise CommandError(
+        f"{command} creates and deletes users in the database "
+        f"'{connection.settings_dict['NAME']}'. Run it against a dedicated "
+        "database with LOADTEST_DATABASE = True, or pass --i-know."
+    )
+
+
+def percentile(values, fraction):
+    """
+    Return the nearest-rank percentile of already sorted values.
+    """
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def to_ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    Summarize request latencies in seconds into a JSON-serializable dict.
+    """
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else None,
+        "mean_ms": to_ms(sum(values) / len(values)) if values else None,
+        "p50_ms": to_ms(percentile(values, 0.5)),
+        "p90_ms": to_ms(percentile(values, 0.9)),
+        "p99_ms": to_ms(percentile(values, 0.99)),
+        "max_ms": to_ms(values[-1]) if values else None,
+    }
+
+
+def parse_importtime(output):
+    """
+    Parse the stderr of python -X importtime into (module, self, cumulative)
+    tuples, with times in seconds.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        modules.append((
+            fields[2].strip(),
+            int(fields[0]) / 1e6,
+            int(fields[1]) / 1e6,
+        ))
+    return modules
@@ -0,0 +1,155 @@
+import asyncio, logging, time, uuid
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+SENT = "sent"
+FAILED = "failed"
+
+
+class StubSender:
+    """
+    Simulate sending an SMS by waiting for the configured delay.
+    """
+
+    def __init__(self):
+        self.delay = settings.SMS_STUB_DELAY
+
+    def send(self, phone, code):
+        time.sleep(self.delay)
+        logger.info("Verification code sent to %s", phone)
+
+    async def asend(self, phone, code):
+        await asyncio.sleep(self.delay)
+        logger.info("Verification code sent to %s", phone)
+
+
+class BaseDeliveryBackend:
+    """
+    Hand verification codes over to the sender and track their status.
+
+    Ticket states are kept in the default cache, so every worker process
+    sharing that cache can answer status requests. Async views submit
+    codes through asubmit, which delivers them from event loop tasks.
+    """
+
+    def __init__(self):
+        self.sender = import_string(settings.SMS_SENDER)()
+        self.tasks = set()
+
+    def submit(self, phone, code):
+        ticket = uuid.uuid4().hex
+        self.set_status(ticket, QUEUED)
+        self.enqueue(ticket, phone, code)
+        return ticket
+
+    def enqueue(self, ticket, phone, code):
+        raise NotImplementedError
+
+    async def asubmit(self, phone, code):
+        ticket = uuid.uuid4().hex
+        await self.aset_status(ticket, QUEUED)
+        await self.aenqueue(ticket, phone, code)
+        return ticket
+
+    async def aenqueue(self, ticket, phone, code):
+        task = asyncio.create_task(self.adeliver(ticket, phone, code))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def adeliver(self, ticket, phone, code):
+        send = getattr(self.sender, "asend", None) or sync_to_async(self.sender.send)
+        try:
+            await send(phone, code)
+        except Exception:
+            logger.exception("Failed to deliver code for ticket %s", ticket)
+            await self.aset_status(ticket, FAILED)
+        else:
+            await self.aset_status(ticket, SENT, sent_at=timezone.now())
+
+    def deliver(self, ticket, phone, code):
+        try:
+            self.sender.send(phone, code)
+        except Exception:
+            logger.exception("Failed to deliver code for ticket %s", ticket)
+            self.set_status(ticket, FAILED)
+        else:
+            self.set_status(ticket, SENT, sent_at=timezone.now())
+
+    def set_status(self, ticket, state, sent_at=None):
+        cache.set(
+            f"sms-ticket:{ticket}",
+            {"status": state, "sent_at": sent_at},
+            settings.SMS_TICKET_TTL
+        )
+
+    async def aset_status(self, ticket, state, sent_at=None):
+        await cache.aset(
+            f"sms-ticket:{ticket}",
+            {"status": state, "sent_at": sent_at},
+            settings.SMS_TICKET_TTL
+        )
+
+    def status(self, ticket):
+        return cache.get(f"sms-ticket:{ticket}")
+
+    def close(self):
+        pass
+
+
+class SyncBackend(BaseDeliveryBackend):
+    """
+    Deliver codes inline, in the request thread.
+    """
+
+    def enqueue(self, ticket, phone, code):
+        self.deliver(ticket, phone, code)
+
+    async def aenqueue(self, ticket, phone, code):
+        await self.adeliver(ticket, phone, code)
+
+
+class ThreadPoolBackend(BaseDeliveryBackend):
+    """
+    Deliver codes from an in-process pool of background threads.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.SMS_DELIVERY_WORKERS,
+            thread_name_prefix="sms-delivery"
+        )
+
+    def enqueue(self, ticket, phone, code):
+        self.executor.submit(self.deliver, ticket, phone, code)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.SMS_DELIVERY_BACKEND)()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting.startswith("SMS_") and _backend is not None:
+        _backend.close()
+        _backend = None
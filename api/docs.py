@@ -0,0 +1,305 @@
+"""
+OpenAPI descriptions of the API views.
+
+They are attached to the views when the schema is first generated, so
+serving requests neither imports drf_yasg nor builds these objects.
+"""
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+from . import views
+
+
+MessageSchema = openapi.Schema(
+    type="object",
+    properties={
+        "message": openapi.Schema(type="string")
+    }
+)
+
+LoginResponseSchema = openapi.Schema(
+    type="object",
+    properties={
+        "phone": openapi.Schema(type="string"),
+        "code": openapi.Schema(type="string"),
+        "ticket": openapi.Schema(type="string")
+    }
+)
+
+DeliveryResponseSchema = openapi.Schema(
+    type="object",
+    properties={
+        "ticket": openapi.Schema(type="string"),
+        "status": openapi.Schema(type="string", enum=["queued", "sent", "failed"]),
+        "sent_at": openapi.Schema(type="string", format="date-time")
+    }
+)
+
+VerifyResponseSchema = openapi.Schema(
+    type="object",
+    properties={
+        "message": openapi.Schema(type="string"),
+        "token": openapi.Schema(type="string")
+    }
+)
+
+DataResponseSchema = openapi.Schema(
+    type="object",
+    properties={
+        "users": openapi.Schema(type="array", items=openapi.Schema(type="string")),
+        "ref": openapi.Schema(type="string"),
+        "invited": openapi.Schema(type="string"),
+        "count": openapi.Schema(type="integer", description="Number of invitees"),
+        "next": openapi.Schema(type="string", description="Cursor of the next page", x_nullable=True)
+    }
+)
+
+ActivationResponseSchema = openapi.Schema(
+    type="object",
+    properties={
+        "message": openapi.Schema(type="string"),
+        "invited": openapi.Schema(type="string")
+    }
+)
+
+TreeResponseSchema = openapi.Schema(
+    type="object",
+    properties={
+        "depth": openapi.Schema(type="integer"),
+        "total": openapi.Schema(type="integer"),
+        "levels": openapi.Schema(
+            type="array",
+            items=openapi.Schema(
+                type="object",
+                properties={
+                    "level": openapi.Schema(type="integer"),
+                    "count": openapi.Schema(type="integer"),
+                    "users": openapi.Schema(type="array", items=openapi.Schema(type="string")),
+                }
+            )
+        )
+    }
+)
+
+LeaderboardResponseSchema = openapi.Schema(
+    type="object",
+    properties={
+        "top": openapi.Schema(
+            type="array",
+            items=openapi.Schema(
+                type="object",
+                properties={
+                    "rank": openapi.Schema(type="integer"),
+                    "ref": openapi.Schema(type="string"),
+                    "count": openapi.Schema(type="integer"),
+                }
+            )
+        ),
+        "ref": openapi.Schema(type="string"),
+        "count": openapi.Schema(type="integer"),
+        "rank": openapi.Schema(type="integer", description="Empty without invitees", x_nullable=True)
+    }
+)
+
+ProfilesResponseSchema = openapi.Schema(
+    type="object",
+    properties={
+        "profiles": openapi.Schema(
+            type="array",
+            items=openapi.Schema(
+                type="object",
+                properties={
+                    "phone": openapi.Schema(type="string"),
+                    "ref": openapi.Schema(type="string"),
+                    "invited": openapi.Schema(type="string"),
+                    "count": openapi.Schema(type="integer"),
+                    "users": openapi.Schema(type="array", items=openapi.Schema(type="string")),
+                }
+            )
+        ),
+        "missing": openapi.Schema(type="array", items=openapi.Schema(type="string"))
+    }
+)
+
+EventsResponseSchema = openapi.Schema(
+    type="object",
+    properties={
+        "events": openapi.Schema(
+            type="array",
+            items=openapi.Schema(
+                type="object",
+                properties={
+                    "id": openapi.Schema(type="integer"),
+                    "invitee": openapi.Schema(type="string"),
+                    "invitee_ref": openapi.Schema(type="string"),
+                    "inviter": openapi.Schema(type="string"),
+                    "count": openapi.Schema(type="integer", description="Invitees of the inviter after the referral"),
+                    "created": openapi.Schema(type="string", format="date-time"),
+                }
+            )
+        ),
+        "next": openapi.Schema(type="integer", description="Cursor to pass as after")
+    }
+)
+
+MetricsResponseSchema = openapi.Schema(
+    type="object",
+    properties={
+        "enabled": openapi.Schema(type="boolean"),
+        "endpoints": openapi.Schema(type="object", description="Histograms per endpoint")
+    }
+)
+
+
+swagger_auto_schema(
+    request_body=openapi.Schema(
+        type="object",
+        properties={
+            "phone": openapi.Schema(type="string", description="Phone number"),
+        },
+        required=["phone"],
+    ),
+    responses={
+        200: openapi.Response(description="Successful response", schema=LoginResponseSchema),
+        400: openapi.Response(description="Bad Request", schema=MessageSchema),
+        429: openapi.Response(description="Too Many Requests"),
+    },
+)(views.LoginView.post)
+
+swagger_auto_schema(
+    responses={
+        200: openapi.Response(description="Successful response", schema=DeliveryResponseSchema),
+        404: openapi.Response(description="Not Found", schema=MessageSchema),
+    },
+)(views.DeliveryStatusView.get)
+
+swagger_auto_schema(
+    manual_parameters=[
+        openapi.Parameter(
+            "Idempotency-Key", openapi.IN_HEADER,
+            description="Replay the stored response to retries with the same key", type="string"
+        ),
+    ],
+    request_body=openapi.Schema(
+        type="object",
+        properties={
+            "phone": openapi.Schema(type="string", description="Phone number"),
+            "verify": openapi.Schema(type="string", description="Verification code"),
+        },
+        required=["phone", "verify"],
+    ),
+    responses={
+        200: openapi.Response(description="Successful response", schema=VerifyResponseSchema),
+        201: openapi.Response(description="Successful response", schema=VerifyResponseSchema),
+        400: openapi.Response(description="Bad Request", schema=MessageSchema),
+        429: openapi.Response(description="Too Many Requests", schema=MessageSchema),
+    },
+)(views.VerifyView.post)
+
+swagger_auto_schema(
+    responses={
+        200: openapi.Response(description="Successful response", schema=VerifyResponseSchema),
+        409: openapi.Response(description="Conflict", schema=MessageSchema),
+    },
+)(views.TokenRotateView.post)
+
+swagger_auto_schema(
+    manual_parameters=[
+        openapi.Parameter("limit", openapi.IN_QUERY, description="Page size", type="integer"),
+        openapi.Parameter("after", openapi.IN_QUERY, description="Cursor returned as next", type="string"),
+        openapi.Parameter("stream", openapi.IN_QUERY, description="Stream all invitees as NDJSON", type="boolean"),
+        openapi.Parameter("count_only", openapi.IN_QUERY, description="Return the number of invitees without the list", type="boolean"),
+    ],
+    responses={
+        200: openapi.Response(description="Successful response", schema=DataResponseSchema),
+        304: openapi.Response(description="Not Modified"),
+        400: openapi.Response(description="Bad Request", schema=MessageSchema),
+    },
+)(views.DataView.get)
+
+swagger_auto_schema(
+    request_body=openapi.Schema(
+        type="object",
+        properties={
+            "ref_code": openapi.Schema(type="string", description="Referral code"),
+        },
+        required=["ref_code"],
+    ),
+    responses={
+        200: openapi.Response(description="Successful response", schema=ActivationResponseSchema),
+        400: openapi.Response(description="Bad Request", schema=MessageSchema),
+        404: openapi.Response(description="Not Found", schema=MessageSchema),
+    },
+)(views.DataView.post)
+
+swagger_auto_schema(
+    manual_parameters=[
+        openapi.Parameter("depth", openapi.IN_QUERY, description="Number of levels", type="integer"),
+        openapi.Parameter("limit", openapi.IN_QUERY, description="Usernames per level", type="integer"),
+    ],
+    responses={
+        200: openapi.Response(description="Successful response", schema=TreeResponseSchema),
+        400: openapi.Response(description="Bad Request", schema=MessageSchema),
+    },
+)(views.ReferralTreeView.get)
+
+swagger_auto_schema(
+    manual_parameters=[
+        openapi.Parameter("limit", openapi.IN_QUERY, description="Number of top referrers", type="integer"),
+        openapi.Parameter("ref", openapi.IN_QUERY, description="Referral code of the ranked user", type="string"),
+    ],
+    responses={
+        200: openapi.Response(description="Successful response", schema=LeaderboardResponseSchema),
+        400: openapi.Response(description="Bad Request", schema=MessageSchema),
+        404: openapi.Response(description="Not Found", schema=MessageSchema),
+    },
+)(views.LeaderboardView.get)
+
+swagger_auto_schema(
+    request_body=openapi.Schema(
+        type="object",
+        properties={
+            "phones": openapi.Schema(type="array", items=openapi.Schema(type="string")),
+            "refs": openapi.Schema(type="array", items=openapi.Schema(type="string")),
+            "invitees": openapi.Schema(type="boolean", description="Include the first invitees of each user"),
+        },
+    ),
+    responses={
+        200: openapi.Response(description="Successful response", schema=ProfilesResponseSchema),
+        400: openapi.Response(description="Bad Request", schema=MessageSchema),
+    },
+)(views.ProfilesView.post)
+
+swagger_auto_schema(
+    manual_parameters=[
+        openapi.Parameter("after", openapi.IN_QUERY, description="Cursor returned as next", type="integer"),
+        openapi.Parameter("limit", openapi.IN_QUERY, description="Page size", type="integer"),
+        openapi.Parameter(
+            "wait", openapi.IN_QUERY, type="number",
+            description="Seconds to wait for new events, up to EVENTS_SYNC_MAX_WAIT. "
+            "Longer waits belong on /api/async/events/",
+        ),
+    ],
+    responses={
+        200: openapi.Response(description="Successful response", schema=EventsResponseSchema),
+        400: openapi.Response(description="Bad Request", schema=MessageSchema),
+    },
+)(views.EventsView.get)
+
+swagger_auto_schema(
+    responses={
+        200: openapi.Response(description="Successful response", schema=MetricsResponseSchema),
+    },
+)(views.MetricsView.get)
+
+swagger_auto_schema(
+    request_body=openapi.Schema(
+        type="object",
+        properties={
+            "enabled": openapi.Schema(type="boolean", description="Profiling state"),
+            "reset": openapi.Schema(type="boolean", description="Clear the histograms"),
+        },
+    ),
+    responses={
+        200: openapi.Response(description="Successful response", schema=MetricsResponseSchema),
+    },
+)(views.MetricsView.post)
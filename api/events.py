@@ -0,0 +1,111 @@
+import asyncio, time
+from django.conf import settings
+from django.db import connections, router
+from .models import ReferralEvent
+
+
+FIELDS = ("id", "invitee", "invitee_ref", "inviter", "count", "created")
+
+# Key of the PostgreSQL advisory lock that orders the event writers.
+LOCK_KEY = 0x5245464556454E54
+
+
+def lock():
+    """
+    Hold the lock that orders the event writers until the transaction ends.
+
+    On PostgreSQL it is a transaction-level advisory lock. SQLite already
+    locks the whole database on the first write of the transaction, so it
+    needs nothing more. Activations take it before their referral is
+    written, so they run one at a time from there to their commit, and
+    activations across all inviters commit at most one per commit
+    latency, a few hundred per second on a local database.
+    """
+    connection = connections[router.db_for_write(ReferralEvent)]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [LOCK_KEY])
+
+
+def record(user, inviter_ref, count, now):
+    """
+    Append the referral of user by inviter_ref. Call it inside the
+    transaction registering the referral.
+
+    Ids are taken when a transaction inserts, not when it commits. The
+    writer holds the lock() until its transaction ends, so events are
+    inserted and committed one at a time in id order, and a consumer's
+    cursor never passes an event still to become visible.
+    """
+    lock()
+    ReferralEvent.objects.create(
+        invitee=user.username,
+        invitee_ref=user.ref,
+        inviter=inviter_ref,
+        count=count,
+        created=now,
+    )
+
+
+def page(after, limit):
+    """
+    Return the events after the cursor, oldest first.
+    """
+    return ReferralEvent.objects.filter(pk__gt=after).order_by(
+        "pk"
+    ).values_list(*FIELDS)[:limit]
+
+
+def serialize(rows):
+    return [
+        dict(zip(FIELDS, row[:-1]), created=row[-1].isoformat())
+        for row in rows
+    ]
+
+
+def poll(after, limit, wait=0):
+    """
+    Return the events after the cursor, waiting up to wait seconds for
+    the first one.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        rows = list(page(after, limit))
+        remaining = deadline - time.monotonic()
+        if rows or remaining <= 0:
+            return serialize(rows)
+        time.sleep(min(settings.EVENTS_POLL_INTERVAL, remaining))
+
+
+async def apoll(after, limit, wait=0):
+    deadline = time.monotonic() + wait
+    while True:
+        rows = [row async for row in page(after, limit)]
+        remaining = deadline - time.monotonic()
+        if rows or remaining <= 0:
+            return serialize(rows)
+        await asyncio.sleep(min(settings.EVENTS_POLL_INTERVAL, remaining))
+
+
+def parse_params(params, max_wait=None):
+    """
+    Validate the after, limit and wait query parameters of the feed.
+    Wait is limited to max_wait seconds, by default EVENTS_MAX_WAIT.
+
+    Return (after, limit, wait) or an error message.
+    """
+    if max_wait is None:
+        max_wait = settings.EVENTS_MAX_WAIT
+    try:
+        after = int(params.get("after", 0))
+        limit = int(params.get("limit", settings.EVENTS_PAGE_SIZE))
+        wait = float(params.get("wait", 0))
+    except ValueError:
+        return "After, limit and wait must be numbers."
+    if after < 0:
+        return "After must not be negative."
+    if not 0 < limit <= settings.EVENTS_MAX_PAGE_SIZE:
+        return f"Limit must be between 1 and {settings.EVENTS_MAX_PAGE_SIZE}."
+    if not 0 <= wait <= max_wait:
+        return f"Wait must be between 0 and {max_wait} seconds."
+    return after, limit, wait
@@ -0,0 +1,88 @@
+import csv, json, struct
+
+
+COLUMNS = ("username", "ref", "invited", "deleted")
+
+# deleted is "1" on the tombstones of users deleted since the previous
+# incremental export, which come before the other rows, and empty
+# otherwise. An empty invited value means no inviter.
+
+# Columnar layout: MAGIC, then row groups, each made of a little-endian
+# uint32 row count followed by every column in COLUMNS order. A column
+# is one length byte per row and the UTF-8 values concatenated. A row
+# count of 0 ends the file.
+MAGIC = b"REFCOL2\n"
+
+
+class CsvWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = None
+
+    def write(self, rows):
+        if self.writer is None:
+            self.writer = csv.writer(self.stream)
+            self.writer.writerow(COLUMNS)
+        self.writer.writerows(rows)
+
+    def close(self):
+        if self.writer is None:
+            self.write([])
+
+
+class NdjsonWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, rows):
+        self.stream.write("".join(
+            json.dumps(dict(zip(COLUMNS, row), deleted=bool(row[-1]))) + "\n" for row in rows
+        ))
+
+    def close(self):
+        pass
+
+
+class ColumnarWriter:
+    binary = True
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.stream.write(MAGIC)
+
+    def write(self, rows):
+        if not rows:
+            return
+        self.stream.write(struct.pack("<I", len(rows)))
+        for column in zip(*rows):
+            values = [value.encode() for value in column]
+            self.stream.write(bytes(len(value) for value in values))
+            self.stream.write(b"".join(values))
+
+    def close(self):
+        self.stream.write(struct.pack("<I", 0))
+
+
+WRITERS = {"csv": CsvWriter, "ndjson": NdjsonWriter, "columnar": ColumnarWriter}
+
+
+def read_columnar(stream):
+    """
+    Yield the rows of a columnar export one row group at a time.
+    """
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a columnar referral export.")
+    while True:
+        (count,) = struct.unpack("<I", stream.read(4))
+        if not count:
+            return
+        columns = []
+        for _ in COLUMNS:
+            lengths = stream.read(count)
+            data = stream.read(sum(lengths))
+            values, position = [], 0
+            for length in lengths:
+                values.append(data[position:position + length].decode())
+                position += length
+            columns.append(values)
+        yield list(zip(*columns))
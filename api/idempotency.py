@@ -0,0 +1,51 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Responses of requests sent with an Idempotency-Key header are kept for
+# IDEMPOTENCY_TTL seconds, so a client retrying after a lost response
+# gets the same answer without the request running again. The cache key
+# covers the request data as well, so the header alone replays nothing.
+# Secrets in a response are stored as fingerprints and resolved again on
+# replay.
+
+HEADER = "Idempotency-Key"
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def make_key(scope, request, *parts):
+    """
+    Return the cache key of a request, or None without the header.
+    """
+    header = request.headers.get(HEADER)
+    if not header:
+        return None
+    digest = hashlib.sha256("\0".join([header, *map(str, parts)]).encode()).hexdigest()
+    return f"idempotency:{scope}:{digest}"
+
+
+def fingerprint(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def lookup(key):
+    """
+    Return the (data, status) of the stored response of key, if any.
+    """
+    return cache.get(key) if key else None
+
+
+def remember(key, data, status):
+    if key:
+        cache.set(key, (data, status), settings.IDEMPOTENCY_TTL)
+
+
+async def alookup(key):
+    return await cache.aget(key) if key else None
+
+
+async def aremember(key, data, status):
+    if key:
+        await cache.aset(key, (data, status), settings.IDEMPOTENCY_TTL)
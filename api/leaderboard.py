@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import ScoreBucket, User
+
+
+# The ranking is kept as a histogram of User.invitee_count: one
+# ScoreBucket row per score with the number of referrers holding it.
+# A referral moves one user between two buckets, and the rank of a score
+# is one plus the users in the buckets above it, so neither needs a scan
+# of the user table. Referrers with equal scores share a rank.
+
+def move(old_score, new_score):
+    """
+    Move one referrer from the old_score bucket to the new_score one.
+    Score 0 is not ranked and has no bucket.
+    """
+    with transaction.atomic():
+        if old_score > 0:
+            ScoreBucket.objects.filter(score=old_score, users__gt=0).update(
+                users=F("users") - 1
+            )
+        if new_score > 0:
+            ScoreBucket.objects.bulk_create(
+                [ScoreBucket(score=new_score, users=0)], ignore_conflicts=True
+            )
+            ScoreBucket.objects.filter(score=new_score).update(users=F("users") + 1)
+
+
+def rebuild():
+    """
+    Recompute every bucket from the stored invitee counts.
+    """
+    scores = User.objects.filter(invitee_count__gt=0).order_by().values(
+        "invitee_count"
+    ).annotate(users=Count("pk")).values_list("invitee_count", "users")
+    with transaction.atomic():
+        ScoreBucket.objects.all().delete()
+        ScoreBucket.objects.bulk_create(
+            [ScoreBucket(score=score, users=users) for score, users in scores]
+        )
+    return ScoreBucket.objects.count()
+
+
+def ranks(scores):
+    """
+    Map each of the given scores to its rank.
+    """
+    scores = {score for score in scores if score > 0}
+    if not scores:
+        return {}
+    buckets = ScoreBucket.objects.filter(
+        score__gte=min(scores), users__gt=0
+    ).order_by("-score").values_list("score", "users")
+    result = {}
+    above = 0
+    for score, users in buckets:
+        if score in scores:
+            result[score] = above + 1
+        above += users
+    for score in scores - result.keys():
+        result[score] = above + 1
+    return result
+
+
+def rank(score):
+    """
+    Return the rank of a score, or None for users without invitees.
+    """
+    if score <= 0:
+        return None
+    key = f"leaderboard-rank:{score}"
+    value = cache.get(key)
+    if value is None:
+        above = ScoreBucket.objects.filter(score__gt=score).aggregate(
+            total=Sum("users")
+        )["total"] or 0
+        value = above + 1
+        cache.set(key, value, settings.LEADERBOARD_CACHE_TTL)
+    return value
+
+
+def top(limit):
+    """
+    Return the limit referrers with the most invitees, best first.
+    """
+    key = f"leaderboard-top:{limit}"
+    entries = cache.get(key)
+    if entries is None:
+        leaders = list(User.objects.filter(invitee_count__gt=0).order_by(
+            "-invitee_count", "username"
+        ).values_list("ref", "invitee_count")[:limit])
+        positions = ranks(score for _, score in leaders)
+        entries = [
+            {"rank": positions[score], "ref": ref, "count": score}
+            for ref, score in leaders
+        ]
+        cache.set(key, entries, settings.LEADERBOARD_CACHE_TTL)
+    return entries
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+    move(instance.invitee_count, 0)
+    if instance.inviter_id is not None:
+        score = User.objects.filter(ref=instance.inviter_id).values_list(
+            "invitee_count", flat=True
+        ).first()
+        if score is not None:
+            move(score + 1, score)
@@ -0,0 +1,128 @@
+import asyncio, json, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from rest_framework.authtoken.models import Token
+from api.bench import require_dedicated_database, summarize
+from api.models import DeletedUser, OneTimeCode, User
+
+
+# In the unassigned +7 001 range, so the logins never reach a subscriber.
+BENCH_PHONE = "70019999990"
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync views served through the WSGI handler with the "
+        "async views served through the ASGI handler, in this process and "
+        "against the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoint", choices=["login", "data"], action="append")
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument(
+            "--threads", type=int, default=4,
+            help="Worker threads of the simulated WSGI server."
+        )
+        parser.add_argument(
+            "--delay", type=float, default=0.2,
+            help="Simulated SMS delivery delay in seconds."
+        )
+        parser.add_argument(
+            "--delivery", choices=["inline", "background"], default="inline",
+            help="Wait for the delivery in the request or hand it to the backend."
+        )
+        parser.add_argument(
+            "--i-know", action="store_true",
+            help="Create and delete the benchmark user even though "
+            "LOADTEST_DATABASE does not mark the database as dedicated."
+        )
+        parser.add_argument("--output", type=Path)
+
+    def handle(self, *args, **options):
+        require_dedicated_database("bench_async", options["i_know"])
+        endpoints = options["endpoint"] or ["login", "data"]
+        backend = {
+            "inline": "api.delivery.SyncBackend",
+            "background": "api.delivery.ThreadPoolBackend",
+        }[options["delivery"]]
+        user, created = User.objects.get_or_create(username=BENCH_PHONE)
+        token, _ = Token.objects.get_or_create(user=user)
+        requests = {
+            "login": ("post", "login/", {"phone": BENCH_PHONE}, {}),
+            "data": ("get", "data/", {}, {"Authorization": f"Token {token.key}"}),
+        }
+        results = {}
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+                SMS_DELIVERY_BACKEND=backend,
+                SMS_STUB_DELAY=options["delay"],
+                THROTTLE_RATES={},
+            ):
+                for endpoint in endpoints:
+                    method, path, data, headers = requests[endpoint]
+                    results[endpoint] = {
+                        "wsgi": self.run_wsgi(
+                            method, f"/api/{path}", data, headers, options
+                        ),
+                        "asgi": asyncio.run(self.run_asgi(
+                            method, f"/api/async/{path}", data, headers, options
+                        )),
+                    }
+        finally:
+            OneTimeCode.objects.filter(phone=BENCH_PHONE).delete()
+            if created:
+                user.delete()
+                DeletedUser.objects.filter(username=BENCH_PHONE).delete()
+        report = {
+            "requests": options["requests"],
+            "concurrency": options["concurrency"],
+            "wsgi_threads": options["threads"],
+            "delivery": options["delivery"],
+            "delay_s": options["delay"],
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            options["output"].write_text(output)
+        self.stdout.write(output)
+
+    def run_wsgi(self, method, path, data, headers, options):
+        workers = threading.Semaphore(options["threads"])
+        local = threading.local()
+
+        def call(_):
+            if not hasattr(local, "client"):
+                local.client = Client(raise_request_exception=False)
+            started = time.perf_counter()
+            with workers:
+                response = getattr(local.client, method)(path, data, headers=headers)
+            return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options["concurrency"]) as pool:
+            calls = list(pool.map(call, range(options["requests"])))
+        return self.summary(calls, time.perf_counter() - started)
+
+    async def run_asgi(self, method, path, data, headers, options):
+        client = AsyncClient(raise_request_exception=False)
+        slots = asyncio.Semaphore(options["concurrency"])
+
+        async def call():
+            async with slots:
+                started = time.perf_counter()
+                response = await getattr(client, method)(path, data, headers=headers)
+                return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        calls = await asyncio.gather(*(call() for _ in range(options["requests"])))
+        return self.summary(calls, time.perf_counter() - started)
+
+    def summary(self, calls, elapsed):
+        errors = sum(1 for _, code in calls if code >= 400)
+        return summarize([latency for latency, _ in calls], elapsed, errors)
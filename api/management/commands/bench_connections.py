@@ -0,0 +1,164 @@
+import json, platform, threading, time
+from pathlib import Path
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from rest_framework.authtoken.models import Token
+from api.bench import require_dedicated_database, summarize
+from api.models import DeletedUser, User
+
+
+# In the unassigned +7 001 range, so the user never belongs to a subscriber.
+BENCH_PHONE = "70019999991"
+
+MODES = ["fresh", "persistent", "pool"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare request latency with a new database connection per "
+        "request, with persistent connections and with a connection pool, "
+        "through the WSGI handler of this process. Persistent connections "
+        "are not reused under ASGI, so their results only apply to WSGI."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=MODES, action="append")
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument(
+            "--path", default="/api/data/tree/?depth=1",
+            help="Authenticated endpoint to request. It should query the database."
+        )
+        parser.add_argument("--max-age", type=int, default=60)
+        parser.add_argument(
+            "--pool-size", type=int,
+            help="Largest pool size. Defaults to the number of threads."
+        )
+        parser.add_argument(
+            "--i-know", action="store_true",
+            help="Create and delete the benchmark user even though "
+            "LOADTEST_DATABASE does not mark the database as dedicated."
+        )
+        parser.add_argument("--output", type=Path)
+
+    def handle(self, *args, **options):
+        require_dedicated_database("bench_connections", options["i_know"])
+        database = connections.settings[DEFAULT_DB_ALIAS]
+        saved = {key: database.get(key) for key in ("CONN_MAX_AGE", "CONN_HEALTH_CHECKS")}
+        saved_options = dict(database["OPTIONS"])
+        user, created = User.objects.get_or_create(username=BENCH_PHONE)
+        token, _ = Token.objects.get_or_create(user=user)
+        results = {}
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+                THROTTLE_RATES={},
+            ):
+                for mode in options["mode"] or MODES:
+                    self.close()
+                    reason = self.configure(database, mode, options)
+                    if reason:
+                        results[mode] = {"skipped": reason}
+                        continue
+                    results[mode] = self.run(token.key, options)
+        finally:
+            self.close()
+            database.update(saved)
+            database["OPTIONS"] = saved_options
+            if created:
+                user.delete()
+                DeletedUser.objects.filter(username=BENCH_PHONE).delete()
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+            },
+            "requests": options["requests"],
+            "threads": options["threads"],
+            "path": options["path"],
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            options["output"].write_text(output)
+        self.stdout.write(output)
+
+    def configure(self, database, mode, options):
+        """
+        Set up the connection settings of a mode, or return why it is unavailable.
+        """
+        database["OPTIONS"] = {
+            key: value for key, value in database["OPTIONS"].items() if key != "pool"
+        }
+        database["CONN_MAX_AGE"] = options["max_age"] if mode == "persistent" else 0
+        database["CONN_HEALTH_CHECKS"] = mode == "persistent"
+        if mode != "pool":
+            return None
+        if connection.vendor != "postgresql" or django.VERSION < (5, 1):
+            return "Connection pools need PostgreSQL and Django 5.1 or later."
+        try:
+            import psycopg_pool  # noqa: F401
+        except ImportError:
+            return "Connection pools need psycopg 3 with the psycopg-pool package."
+        database["OPTIONS"]["pool"] = {
+            "min_size": 1,
+            "max_size": options["pool_size"] or options["threads"],
+            "timeout": settings.DB_POOL_TIMEOUT,
+        }
+        return None
+
+    def close(self):
+        connection.close()
+        if hasattr(connection, "close_pool"):
+            connection.close_pool()
+
+    def run(self, token, options):
+        lock = threading.Lock()
+        opened = []
+        calls = []
+
+        def count(sender, connection, **kwargs):
+            with lock:
+                opened.append(connection.alias)
+
+        def work(requests):
+            client = Client(raise_request_exception=False)
+            try:
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    response = client.get(
+                        options["path"], headers={"Authorization": f"Token {token}"}
+                    )
+                    # The test client skips the request_finished cleanup a
+                    # server runs, which closes connections past their age.
+                    close_old_connections()
+                    with lock:
+                        calls.append((time.perf_counter() - started, response.status_code))
+            finally:
+                connection.close()
+
+        threads = options["threads"]
+        shares = [
+            options["requests"] // threads + (i < options["requests"] % threads)
+            for i in range(threads)
+        ]
+        workers = [threading.Thread(target=work, args=(share,)) for share in shares]
+        connection_created.connect(count)
+        started = time.perf_counter()
+        try:
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            connection_created.disconnect(count)
+        elapsed = time.perf_counter() - started
+        errors = sum(1 for _, code in calls if code >= 400)
+        result = summarize([latency for latency, _ in calls], elapsed, errors)
+        result["connects"] = len(opened)
+        return result
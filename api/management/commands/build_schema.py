@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.core.cache import cache
+from api import schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the OpenAPI schema of the current code version, store it "
+        "gzipped in SCHEMA_ARTIFACT_DIR and drop artifacts of older versions."
+    )
+
+    def handle(self, *args, **options):
+        version = schema.code_version()
+        for fmt in schema.FORMATS:
+            data = schema.build(fmt)
+            path = schema.write_artifact(fmt, data)
+            cache.set(f"openapi:{version}:{fmt}", data, None)
+            self.stdout.write(f"Wrote {path} ({len(data)} bytes).")
+        for path in path.parent.glob("openapi-*.gz"):
+            if not path.name.startswith(f"openapi-{version}."):
+                path.unlink()
+                self.stdout.write(f"Removed {path}.")
+        self.stdout.write(self.style.SUCCESS(f"Schema version {version} built."))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.otp import get_store
+
+
+class Command(BaseCommand):
+    help = "Delete expired one-time verification codes."
+
+    def handle(self, *args, **options):
+        deleted = get_store().cleanup()
+        self.stdout.write(f"Deleted {deleted} expired codes.")
@@ -0,0 +1,115 @@
+import csv, json
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from api.models import User
+from api.refcodes import allocator
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users and tokens for the phone numbers listed in a CSV file "
+        "with a 'phone' column or in an NDJSON file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path)
+        parser.add_argument("--format", choices=["csv", "ndjson"])
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--state-file", type=Path,
+            help="Where to record progress. Defaults to <path>.state."
+        )
+        parser.add_argument(
+            "--resume", action="store_true",
+            help="Skip the records imported by a previous run."
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not path.exists():
+            raise CommandError(f"File {path} does not exist.")
+        fmt = options["format"] or ("csv" if path.suffix == ".csv" else "ndjson")
+        state_file = options["state_file"] or path.with_name(path.name + ".state")
+        done = 0
+        if options["resume"] and state_file.exists():
+            done = json.loads(state_file.read_text())["records"]
+        batch_size = options["batch_size"]
+        position = created = invalid = 0
+        batch = []
+        with path.open(newline="") as source:
+            for phone in self.read(source, fmt):
+                position += 1
+                if position <= done:
+                    continue
+                digits = "".join(filter(str.isdigit, phone))
+                if len(digits) != 11:
+                    invalid += 1
+                else:
+                    batch.append(digits)
+                if len(batch) == batch_size:
+                    created += self.import_batch(batch)
+                    batch = []
+                    self.checkpoint(state_file, position, created, invalid)
+            if batch:
+                created += self.import_batch(batch)
+            self.checkpoint(state_file, position, created, invalid)
+        self.stdout.write(self.style.SUCCESS(
+            f"Import finished: {created} users created, {invalid} invalid records."
+        ))
+
+    def read(self, source, fmt):
+        if fmt == "csv":
+            reader = csv.DictReader(source)
+            if "phone" not in (reader.fieldnames or []):
+                raise CommandError("CSV file must have a 'phone' column.")
+            for row in reader:
+                yield row["phone"] or ""
+        else:
+            for line in source:
+                if line.strip():
+                    record = json.loads(line)
+                    yield str(record["phone"] if isinstance(record, dict) else record)
+
+    def import_batch(self, phones):
+        phones = list(dict.fromkeys(phones))
+        created = 0
+        with transaction.atomic():
+            missing = set(phones) - set(
+                User.objects.filter(username__in=phones).values_list("username", flat=True)
+            )
+            # A code may clash with a legacy random code, in which case the
+            # row is skipped by ignore_conflicts and retried with a new one.
+            for _ in range(settings.REF_CODE_RETRIES):
+                if not missing:
+                    break
+                now = timezone.now()
+                password = make_password(None)
+                users = [
+                    User(username=phone, ref=ref, password=password, date_joined=now)
+                    for phone, ref in zip(missing, allocator.allocate(len(missing)))
+                ]
+                User.objects.bulk_create(users, ignore_conflicts=True)
+                inserted = set(
+                    User.objects.filter(username__in=missing).values_list("username", flat=True)
+                )
+                created += len(inserted)
+                missing -= inserted
+            if missing:
+                raise CommandError("Could not allocate unique referral codes.")
+            user_ids = User.objects.filter(username__in=phones).values_list("pk", flat=True)
+            Token.objects.bulk_create(
+                [Token(key=Token.generate_key(), user_id=pk) for pk in user_ids],
+                ignore_conflicts=True
+            )
+        return created
+
+    def checkpoint(self, state_file, position, created, invalid):
+        state_file.write_text(json.dumps({"records": position}))
+        self.stdout.write(
+            f"Processed {position} records: {created} users created, {invalid} invalid."
+        )
@@ -0,0 +1,230 @@
+import json, platform, random, threading, time
+import urllib.error, urllib.parse, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from rest_framework.authtoken.models import Token
+from api import leaderboard
+from api.bench import require_dedicated_database, summarize
+from api.models import DeletedUser, OneTimeCode, User
+from api.refcodes import allocator
+
+
+# +7 000 and +7 001 are not assigned to any operator, so the generated
+# numbers never belong to a real subscriber.
+SEED_PREFIX = "7000"
+SIGNUP_PREFIX = "7001"
+
+
+class InProcessTransport:
+    """
+    Send requests through the WSGI handler of this process.
+    """
+
+    name = "in-process"
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def request(self, method, path, data=None, token=None):
+        if not hasattr(self.local, "client"):
+            self.local.client = Client(raise_request_exception=False)
+        headers = {"Authorization": f"Token {token}"} if token else {}
+        if method == "get":
+            response = self.local.client.get(path, data or {}, headers=headers)
+        else:
+            response = self.local.client.post(
+                path, data or {}, content_type="application/json", headers=headers
+            )
+        body = response.json() if response.get("Content-Type") == "application/json" else None
+        return response.status_code, body
+
+
+class HttpTransport:
+    """
+    Send requests to a running server.
+    """
+
+    name = "http"
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, data=None, token=None):
+        url = self.base_url + path
+        headers = {"Accept": "application/json"}
+        if token:
+            headers["Authorization"] = f"Token {token}"
+        payload = None
+        if method == "get":
+            if data:
+                url += "?" + urllib.parse.urlencode(data)
+        else:
+            payload = json.dumps(data or {}).encode()
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(url, payload, headers, method=method.upper())
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as error:
+            return error.code, None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed users with a skewed referral fan-out, drive the signup flow "
+        "(login, verify, data, referral) and profile reads concurrently, and "
+        "report throughput and latency percentiles per endpoint as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Users to seed.")
+        parser.add_argument(
+            "--referral-rate", type=float, default=0.8,
+            help="Share of seeded users that registered a referral code."
+        )
+        parser.add_argument(
+            "--skew", type=float, default=3.0,
+            help="Higher values concentrate invitees on fewer referrers."
+        )
+        parser.add_argument("--signups", type=int, default=100, help="Signup flows to run.")
+        parser.add_argument("--reads", type=int, default=1000, help="Profile reads to run.")
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--url", help="Base URL of a running server, which needs "
+            "OTP_EXPOSE_CODE = True for the signups to verify. Requests are "
+            "sent through the in-process WSGI handler when omitted."
+        )
+        parser.add_argument(
+            "--throttle", action="store_true",
+            help="Keep the login and verify rate limits of the in-process "
+            "handler. A running server applies its own limits."
+        )
+        parser.add_argument("--keep", action="store_true", help="Keep the seeded data.")
+        parser.add_argument(
+            "--i-know", action="store_true",
+            help="Seed and clean up the database even though LOADTEST_DATABASE "
+            "does not mark it as a dedicated load test database."
+        )
+        parser.add_argument("--output", type=Path)
+
+    def handle(self, *args, **options):
+        require_dedicated_database("loadtest", options["i_know"])
+        rng = random.Random(options["seed"])
+        self.cleanup()
+        started = time.perf_counter()
+        refs, tokens = self.seed(options["users"], options["referral_rate"], options["skew"], rng)
+        seed_time = time.perf_counter() - started
+        transport = HttpTransport(options["url"]) if options["url"] else InProcessTransport()
+        self.samples = {}
+        try:
+            throttle_rates = settings.THROTTLE_RATES if options["throttle"] else {}
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+                OTP_EXPOSE_CODE=True,
+                THROTTLE_RATES=throttle_rates,
+            ):
+                signups = self.run(
+                    options["concurrency"],
+                    [(self.signup, transport, i, rng.choice(refs)) for i in range(options["signups"])]
+                )
+                reads = self.run(
+                    options["concurrency"],
+                    [(self.read, transport, rng.choice(tokens)) for _ in range(options["reads"])]
+                )
+        finally:
+            if not options["keep"]:
+                self.cleanup()
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "transport": transport.name,
+            },
+            "parameters": {
+                key: options[key] for key in (
+                    "users", "referral_rate", "skew", "signups", "reads", "concurrency",
+                    "seed", "throttle"
+                )
+            },
+            "seed_s": round(seed_time, 4),
+            "phases": {"signup": signups, "read": reads},
+            "endpoints": {
+                name: summarize([latency for latency, _ in calls], 0, sum(1 for _, code in calls if code >= 400))
+                for name, calls in self.samples.items()
+            },
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            options["output"].write_text(output)
+        self.stdout.write(output)
+
+    def seed(self, count, referral_rate, skew, rng):
+        refs = allocator.allocate(count)
+        password = make_password(None)
+        users = []
+        for i, ref in enumerate(refs):
+            inviter = None
+            if i and rng.random() < referral_rate:
+                inviter = int(i * rng.random() ** skew)
+                users[inviter].invitee_count += 1
+            users.append(User(
+                username=f"{SEED_PREFIX}{i:07d}",
+                ref=ref,
+                inviter_id=None if inviter is None else refs[inviter],
+                password=password
+            ))
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=5000)
+            user_ids = User.objects.filter(
+                username__startswith=SEED_PREFIX
+            ).values_list("pk", flat=True)
+            tokens = [Token(key=Token.generate_key(), user_id=pk) for pk in user_ids]
+            Token.objects.bulk_create(tokens, batch_size=5000)
+            leaderboard.rebuild()
+        return refs, [token.key for token in tokens]
+
+    def cleanup(self):
+        for prefix in (SEED_PREFIX, SIGNUP_PREFIX):
+            User.objects.filter(username__startswith=prefix).delete()
+            OneTimeCode.objects.filter(phone__startswith=prefix).delete()
+            DeletedUser.objects.filter(username__startswith=prefix).delete()
+
+    def run(self, concurrency, tasks):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            for future in [pool.submit(*task) for task in tasks]:
+                future.result()
+        elapsed = time.perf_counter() - started
+        return {
+            "tasks": len(tasks),
+            "elapsed_s": round(elapsed, 4),
+            "tasks_per_s": round(len(tasks) / elapsed, 2) if elapsed else None,
+        }
+
+    def timed(self, transport, endpoint, method, path, data=None, token=None):
+        started = time.perf_counter()
+        code, body = transport.request(method, path, data, token)
+        self.samples.setdefault(endpoint, []).append((time.perf_counter() - started, code))
+        return body or {}
+
+    def signup(self, transport, index, ref_code):
+        phone = f"{SIGNUP_PREFIX}{index:07d}"
+        body = self.timed(transport, "login", "post", "/api/login/", {"phone": phone})
+        body = self.timed(
+            transport, "verify", "post", "/api/verify/", {"phone": phone, "verify": body.get("code")}
+        )
+        token = body.get("token")
+        if token:
+            self.timed(transport, "data", "get", "/api/data/", token=token)
+            self.timed(transport, "referral", "post", "/api/data/", {"ref_code": ref_code}, token)
+
+    def read(self, transport, token):
+        self.timed(transport, "data", "get", "/api/data/", token=token)
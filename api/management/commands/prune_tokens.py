@@ -0,0 +1,41 @@
+import time
+from django.core.management.base import BaseCommand
+from rest_framework.authtoken.models import Token
+from api.authentication import expiry_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired authentication tokens. The table is walked in key "
+        "order in batches, and each batch is deleted in its own short "
+        "statement."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--pause", type=float, default=0,
+            help="Seconds to sleep between batches."
+        )
+
+    def handle(self, *args, **options):
+        cutoff = expiry_cutoff()
+        if cutoff is None:
+            self.stdout.write("Tokens do not expire (TOKEN_TTL is None).")
+            return
+        last = ""
+        deleted = 0
+        while True:
+            batch = list(Token.objects.filter(key__gt=last).order_by("key").values_list(
+                "key", "created"
+            )[:options["batch_size"]])
+            if not batch:
+                break
+            last = batch[-1][0]
+            expired = [key for key, created in batch if created <= cutoff]
+            if expired:
+                # Tokens refreshed since the batch was read are kept.
+                deleted += Token.objects.filter(key__in=expired, created__lte=cutoff).delete()[0]
+            if options["pause"]:
+                time.sleep(options["pause"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired tokens."))
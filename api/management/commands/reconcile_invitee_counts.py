@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+from api import leaderboard
+from api.models import User
+from api.referrals import actual_invitee_count
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount User.invitee_count in primary key batches, fix drifted rows "
+        "and rebuild the leaderboard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        actual = actual_invitee_count()
+        last = User.objects.aggregate(last=Max("pk"))["last"] or 0
+        fixed = 0
+        for start in range(0, last + 1, batch_size):
+            fixed += User.objects.filter(
+                pk__gte=start, pk__lt=start + batch_size
+            ).exclude(invitee_count=actual).update(
+                invitee_count=actual, modified=timezone.now()
+            )
+        leaderboard.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Fixed {fixed} invitee counts."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api import leaderboard
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the leaderboard from the stored invitee counts. Run it "
+        "periodically to correct drift of the incremental updates."
+    )
+
+    def handle(self, *args, **options):
+        buckets = leaderboard.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {buckets} leaderboard buckets."))
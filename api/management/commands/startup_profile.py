@@ -0,0 +1,142 @@
+import json, os, platform, statistics, subprocess, sys, time
+from pathlib import Path
+import django
+from django.core.management.base import BaseCommand, CommandError
+from api.bench import parse_importtime, to_ms
+
+
+TARGETS = ["wsgi", "asgi"]
+
+# Run in a fresh interpreter: load the application module, then pass one
+# GET request through it, and print both timings as JSON.
+CHILD = """
+import asyncio, io, json, sys, time
+started = time.perf_counter()
+module = __import__("referral." + sys.argv[1], fromlist=["application"])
+loaded = time.perf_counter()
+from django.conf import settings
+path, _, query = sys.argv[2].partition("?")
+host = next((h for h in settings.ALLOWED_HOSTS if h.strip(".*")), "localhost").lstrip(".")
+if sys.argv[1] == "wsgi":
+    statuses = []
+    environ = {
+        "REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": query,
+        "SCRIPT_NAME": "", "SERVER_NAME": host, "SERVER_PORT": "80",
+        "HTTP_HOST": host, "REMOTE_ADDR": "127.0.0.1",
+        "wsgi.input": io.BytesIO(), "wsgi.errors": sys.stderr,
+        "wsgi.url_scheme": "http",
+    }
+    response = module.application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b"".join(response)
+    response.close()
+    status = int(statuses[0].split()[0])
+else:
+    messages = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "",
+        "headers": [(b"host", host.encode())],
+        "client": ("127.0.0.1", 0), "server": (host, 80),
+    }
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.Future()
+    async def send(message):
+        messages.append(message)
+    asyncio.run(module.application(scope, receive, send))
+    status = messages[0]["status"]
+served = time.perf_counter()
+print(json.dumps({"import": loaded - started, "first_request": served - loaded, "status": status}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how long referral/wsgi.py and referral/asgi.py take to "
+        "import and to serve their first request, each in a fresh "
+        "interpreter, and break the import time down by module."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", choices=TARGETS, action="append")
+        parser.add_argument(
+            "--profile", action="append",
+            help="Settings module to measure. Repeat it to compare several. "
+                 "Defaults to the current settings."
+        )
+        parser.add_argument(
+            "--path", default="/api/leaderboard/",
+            help="Path of the first request. The default one needs no database."
+        )
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--top", type=int, default=15)
+        parser.add_argument("--output", type=Path)
+
+    def handle(self, *args, **options):
+        profiles = {}
+        for profile in options["profile"] or [os.environ["DJANGO_SETTINGS_MODULE"]]:
+            profiles[profile] = {
+                target: self.measure(profile, target, options)
+                for target in options["target"] or TARGETS
+            }
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+            },
+            "path": options["path"],
+            "runs": options["runs"],
+            "profiles": profiles,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            options["output"].write_text(output)
+        self.stdout.write(output)
+
+    def run(self, profile, target, path, *flags):
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": profile}
+        started = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, *flags, "-c", CHILD, target, path],
+            capture_output=True, text=True, env=env,
+        )
+        elapsed = time.perf_counter() - started
+        if process.returncode:
+            raise CommandError(f"{profile} {target} failed:\n{process.stderr}")
+        return json.loads(process.stdout.splitlines()[-1]), elapsed, process.stderr
+
+    def measure(self, profile, target, options):
+        # Timed runs go without -X importtime, which slows imports down.
+        runs = [
+            self.run(profile, target, options["path"])
+            for _ in range(max(options["runs"], 1))
+        ]
+        timings, _, _ = zip(*runs)
+        _, _, stderr = self.run(profile, target, options["path"], "-X", "importtime")
+        modules = parse_importtime(stderr)
+        packages = {}
+        for name, own, _ in modules:
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0) + own
+        top = options["top"]
+        return {
+            "status": timings[-1]["status"],
+            "import_ms": to_ms(statistics.median(t["import"] for t in timings)),
+            "first_request_ms": to_ms(statistics.median(t["first_request"] for t in timings)),
+            "time_to_first_request_ms": to_ms(statistics.median(
+                t["import"] + t["first_request"] for t in timings
+            )),
+            "process_ms": to_ms(statistics.median(elapsed for _, elapsed, _ in runs)),
+            "modules": len(modules),
+            "packages": [
+                {"package": package, "self_ms": to_ms(own)}
+                for package, own in sorted(packages.items(), key=lambda item: -item[1])[:top]
+            ],
+            "slowest": [
+                {"module": name, "self_ms": to_ms(own), "cumulative_ms": to_ms(cumulative)}
+                for name, own, cumulative in sorted(modules, key=lambda item: -item[1])[:top]
+            ],
+        }
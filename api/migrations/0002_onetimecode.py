@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OneTimeCode',
+            fields=[
+                ('phone', models.CharField(max_length=11, primary_key=True, serialize=False, verbose_name='Телефон')),
+                ('code', models.CharField(max_length=4, verbose_name='Код')),
+                ('expires', models.DateTimeField(db_index=True, verbose_name='Истекает')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попытки')),
+            ],
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Exists, F, Max, OuterRef
+
+
+BATCH_SIZE = 5000
+
+
+def batches(User):
+    last = User.objects.aggregate(last=Max('pk'))['last'] or 0
+    for start in range(0, last + 1, BATCH_SIZE):
+        yield User.objects.filter(pk__gte=start, pk__lt=start + BATCH_SIZE)
+
+
+def backfill_inviter(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    known_ref = User.objects.filter(ref=OuterRef('invited'))
+    for batch in batches(User):
+        batch.filter(inviter__isnull=True).exclude(invited='').filter(
+            Exists(known_ref)
+        ).update(inviter_id=F('invited'))
+
+
+def backfill_invited(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    for batch in batches(User):
+        batch.filter(inviter__isnull=False).update(invited=F('inviter_id'))
+
+
+class Migration(migrations.Migration):
+
+    # Every backfill batch is committed separately, so rows are never
+    # locked for the duration of the whole table update.
+    atomic = False
+
+    dependencies = [
+        ('api', '0002_onetimecode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='inviter',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invitees', to=settings.AUTH_USER_MODEL, to_field='ref', verbose_name='Приглашён'),
+        ),
+        migrations.RunPython(backfill_inviter, backfill_invited),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:49
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_user_inviter'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='user',
+            name='invited',
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:59
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 5000
+
+
+def backfill_invitee_count(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    counts = User.objects.filter(inviter_id=OuterRef('ref')).order_by().values(
+        'inviter_id'
+    ).annotate(total=Count('pk')).values('total')
+    last = User.objects.aggregate(last=Max('pk'))['last'] or 0
+    for start in range(0, last + 1, BATCH_SIZE):
+        User.objects.filter(pk__gte=start, pk__lt=start + BATCH_SIZE).update(
+            invitee_count=Coalesce(Subquery(counts), 0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    # Every backfill batch is committed separately, like in 0003.
+    atomic = False
+
+    dependencies = [
+        ('api', '0006_codesequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='invitee_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Приглашено'),
+        ),
+        migrations.RunPython(backfill_invitee_count, migrations.RunPython.noop),
+    ]
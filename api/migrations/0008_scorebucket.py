@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:02
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_buckets(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    ScoreBucket = apps.get_model('api', 'ScoreBucket')
+    scores = User.objects.filter(invitee_count__gt=0).order_by().values(
+        'invitee_count'
+    ).annotate(users=Count('pk')).values_list('invitee_count', 'users')
+    ScoreBucket.objects.bulk_create(
+        [ScoreBucket(score=score, users=users) for score, users in scores]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_user_invitee_count'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreBucket',
+            fields=[
+                ('score', models.PositiveIntegerField(primary_key=True, serialize=False, verbose_name='Приглашено')),
+                ('users', models.PositiveIntegerField(default=0, verbose_name='Пользователи')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('invitee_count__gt', 0)), fields=['-invitee_count', 'username'], name='api_user_leaderboard'),
+        ),
+        migrations.RunPython(fill_buckets, migrations.RunPython.noop),
+    ]
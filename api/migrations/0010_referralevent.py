@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_user_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('invitee', models.CharField(max_length=11, verbose_name='Приглашённый')),
+                ('invitee_ref', models.CharField(max_length=6, verbose_name='Реферал приглашённого')),
+                ('inviter', models.CharField(max_length=6, verbose_name='Пригласивший')),
+                ('count', models.PositiveIntegerField(verbose_name='Приглашено')),
+                ('created', models.DateTimeField(verbose_name='Создано')),
+            ],
+        ),
+    ]
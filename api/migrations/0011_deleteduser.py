@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_referralevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=11, verbose_name='Телефон')),
+                ('ref', models.CharField(max_length=6, verbose_name='Реферал')),
+                ('deleted', models.DateTimeField(db_index=True, verbose_name='Удалён')),
+            ],
+        ),
+    ]
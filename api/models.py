@@ -1,9 +1,11 @@
-import random, string
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
-from django.db.models.signals import pre_save
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, pre_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+from .refcodes import allocator
 
 
 # Create your models here.
@@ -11,15 +13,101 @@ from django.dispatch import receiver
 class User(AbstractUser):
     username = models.CharField('Телефон', max_length=11, unique=True)
     ref = models.CharField('Реферал', max_length=6, unique=True)
-    invited = models.CharField('Приглашён', max_length=6, default="")
+    inviter = models.ForeignKey(
+        'self',
+        verbose_name='Приглашён',
+        to_field='ref',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='invitees',
+        db_index=False,
+    )
+    invitee_count = models.PositiveIntegerField('Приглашено', default=0)
+    # Set by save(); queryset updates of User rows must set it themselves,
+    # or incremental exports miss the change.
+    modified = models.DateTimeField('Изменён', auto_now=True, db_index=True)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(
+                fields=['inviter', 'username'], name='api_user_inviter_username'
+            ),
+            models.Index(
+                fields=['-invitee_count', 'username'],
+                name='api_user_leaderboard',
+                condition=models.Q(invitee_count__gt=0),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding or self.ref:
+            return super().save(*args, **kwargs)
+        # Codes issued before the allocator existed were random and may
+        # clash with an allocated one; such a code is skipped.
+        for _ in range(settings.REF_CODE_RETRIES):
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if not User.objects.filter(ref=self.ref).exists():
+                    raise
+                self.ref = ""
+        raise IntegrityError("Could not allocate a unique referral code.")
+
+class OneTimeCode(models.Model):
+    phone = models.CharField('Телефон', max_length=11, primary_key=True)
+    code = models.CharField('Код', max_length=4)
+    expires = models.DateTimeField('Истекает', db_index=True)
+    attempts = models.PositiveSmallIntegerField('Попытки', default=0)
+
+class CodeSequence(models.Model):
+    name = models.CharField('Название', max_length=32, primary_key=True)
+    value = models.BigIntegerField('Значение', default=0)
+
+class ScoreBucket(models.Model):
+    score = models.PositiveIntegerField('Приглашено', primary_key=True)
+    users = models.PositiveIntegerField('Пользователи', default=0)
+
+class ReferralEvent(models.Model):
+    # Append-only outbox of registered referrals, written in the same
+    # transaction. Codes and numbers are copied, so events outlive users.
+    invitee = models.CharField('Приглашённый', max_length=11)
+    invitee_ref = models.CharField('Реферал приглашённого', max_length=6)
+    inviter = models.CharField('Пригласивший', max_length=6)
+    count = models.PositiveIntegerField('Приглашено')
+    created = models.DateTimeField('Создано')
+
+class DeletedUser(models.Model):
+    # Tombstones of deleted users, written in the deleting transaction, so
+    # incremental exports can drop them.
+    username = models.CharField('Телефон', max_length=11)
+    ref = models.CharField('Реферал', max_length=6)
+    deleted = models.DateTimeField('Удалён', db_index=True)
 
 @receiver(pre_save, sender=User)
 def gen_ref(sender, instance, **kwargs):
     if not instance.ref:
-        while True:
-            ref = ''.join(
-                random.choices(string.ascii_letters + string.digits, k=6)
-            )
-            if not User.objects.filter(ref=ref).exists():
-                instance.ref = ref
-                break
+        instance.ref = allocator.next_code()
+
+
+@receiver(post_delete, sender=User)
+def count_deleted_invitee(sender, instance, **kwargs):
+    if instance.inviter_id is not None:
+        User.objects.filter(
+            ref=instance.inviter_id, invitee_count__gt=0
+        ).update(invitee_count=F('invitee_count') - 1, modified=timezone.now())
+
+
+@receiver(post_delete, sender=User)
+def record_deleted_user(sender, instance, **kwargs):
+    DeletedUser.objects.create(
+        username=instance.username, ref=instance.ref, deleted=timezone.now()
+    )
+
+
+@receiver(pre_delete, sender=User)
+def touch_invitees(sender, instance, **kwargs):
+    # The invitees lose their inviter through SET_NULL, which does not
+    # touch the modified column.
+    User.objects.filter(inviter_id=instance.ref).update(modified=timezone.now())
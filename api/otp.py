@@ -0,0 +1,218 @@
+import hmac, threading
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import OneTimeCode
+
+
+VALID = "valid"
+INVALID = "invalid"
+EXPIRED = "expired"
+LOCKED = "locked"
+MISSING = "missing"
+
+
+class BaseOTPStore:
+    """
+    Keep one verification code per phone number.
+
+    A code is valid for OTP_TTL seconds and is dropped once it is used.
+    After OTP_MAX_ATTEMPTS wrong guesses it is locked until it expires or
+    a new code is issued.
+    """
+
+    def __init__(self):
+        self.ttl = settings.OTP_TTL
+        self.max_attempts = settings.OTP_MAX_ATTEMPTS
+
+    def issue(self, phone, code):
+        raise NotImplementedError
+
+    def verify(self, phone, code):
+        raise NotImplementedError
+
+    def cleanup(self):
+        return 0
+
+    async def aissue(self, phone, code):
+        await sync_to_async(self.issue)(phone, code)
+
+    async def averify(self, phone, code):
+        return await sync_to_async(self.verify)(phone, code)
+
+    def expiry(self):
+        return timezone.now() + timedelta(seconds=self.ttl)
+
+    def check(self, stored, code, expires, attempts):
+        if expires <= timezone.now():
+            return EXPIRED
+        if attempts >= self.max_attempts:
+            return LOCKED
+        if hmac.compare_digest(stored, str(code or "")):
+            return VALID
+        return INVALID
+
+
+class MemoryOTPStore(BaseOTPStore):
+    """
+    Keep codes in a process-local dictionary. Suitable for development.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.codes = {}
+        self.lock = threading.Lock()
+
+    def issue(self, phone, code):
+        with self.lock:
+            self.codes[phone] = [code, self.expiry(), 0]
+
+    def verify(self, phone, code):
+        with self.lock:
+            entry = self.codes.get(phone)
+            if entry is None:
+                return MISSING
+            result = self.check(entry[0], code, entry[1], entry[2])
+            if result == INVALID:
+                entry[2] += 1
+            elif result != LOCKED:
+                del self.codes[phone]
+            return result
+
+    async def aissue(self, phone, code):
+        self.issue(phone, code)
+
+    async def averify(self, phone, code):
+        return self.verify(phone, code)
+
+    def cleanup(self):
+        now = timezone.now()
+        with self.lock:
+            expired = [k for k, v in self.codes.items() if v[1] <= now]
+            for phone in expired:
+                del self.codes[phone]
+        return len(expired)
+
+
+class DatabaseOTPStore(BaseOTPStore):
+    """
+    Keep codes in the OneTimeCode table, keyed by phone number.
+    """
+
+    def issue(self, phone, code):
+        OneTimeCode.objects.update_or_create(
+            phone=phone,
+            defaults={"code": code, "expires": self.expiry(), "attempts": 0}
+        )
+
+    def verify(self, phone, code):
+        try:
+            entry = OneTimeCode.objects.get(phone=phone)
+        except OneTimeCode.DoesNotExist:
+            return MISSING
+        result = self.check(entry.code, code, entry.expires, entry.attempts)
+        if result == LOCKED:
+            return result
+        # Concurrent guesses are gated on the stored attempts, so no more
+        # than OTP_MAX_ATTEMPTS of them are ever compared with the code.
+        entries = OneTimeCode.objects.filter(phone=phone, code=entry.code)
+        if result == INVALID:
+            entries.filter(attempts__lt=self.max_attempts).update(
+                attempts=F("attempts") + 1
+            )
+        elif result == EXPIRED:
+            entries.delete()
+        elif not entries.filter(attempts__lt=self.max_attempts).delete()[0]:
+            return MISSING
+        return result
+
+    async def aissue(self, phone, code):
+        await OneTimeCode.objects.aupdate_or_create(
+            phone=phone,
+            defaults={"code": code, "expires": self.expiry(), "attempts": 0}
+        )
+
+    async def averify(self, phone, code):
+        try:
+            entry = await OneTimeCode.objects.aget(phone=phone)
+        except OneTimeCode.DoesNotExist:
+            return MISSING
+        result = self.check(entry.code, code, entry.expires, entry.attempts)
+        if result == LOCKED:
+            return result
+        entries = OneTimeCode.objects.filter(phone=phone, code=entry.code)
+        if result == INVALID:
+            await entries.filter(attempts__lt=self.max_attempts).aupdate(
+                attempts=F("attempts") + 1
+            )
+        elif result == EXPIRED:
+            await entries.adelete()
+        elif not (await entries.filter(attempts__lt=self.max_attempts).adelete())[0]:
+            return MISSING
+        return result
+
+    def cleanup(self):
+        deleted, _ = OneTimeCode.objects.filter(
+            expires__lte=timezone.now()
+        ).delete()
+        return deleted
+
+
+class CacheOTPStore(BaseOTPStore):
+    """
+    Keep codes in a Django cache shared by all worker processes, such as
+    Redis. Entries expire together with the cache keys.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.cache = caches[settings.OTP_CACHE]
+
+    def issue(self, phone, code):
+        self.cache.set_many(
+            {f"otp:{phone}": (code, self.expiry()), f"otp-attempts:{phone}": 0},
+            self.ttl
+        )
+
+    def verify(self, phone, code):
+        entry = self.cache.get(f"otp:{phone}")
+        if entry is None:
+            return MISSING
+        # Every guess claims an attempt before it is compared, and a valid
+        # code only succeeds for the request whose delete removed it, so
+        # concurrent requests can neither exceed the attempts nor reuse it.
+        try:
+            attempts = self.cache.incr(f"otp-attempts:{phone}")
+        except ValueError:
+            return MISSING
+        result = self.check(entry[0], code, entry[1], attempts - 1)
+        if result == VALID:
+            if not self.cache.delete(f"otp:{phone}"):
+                return MISSING
+            self.cache.delete(f"otp-attempts:{phone}")
+        elif result == EXPIRED:
+            self.cache.delete_many([f"otp:{phone}", f"otp-attempts:{phone}"])
+        return result
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = import_string(settings.OTP_STORE)()
+    return _store
+
+
+@receiver(setting_changed)
+def reset_store(setting, **kwargs):
+    global _store
+    if setting.startswith("OTP_"):
+        _store = None
@@ -0,0 +1,83 @@
+import hashlib, json, time
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import User
+
+
+def get_cache():
+    return caches[settings.PROFILE_CACHE_ALIAS]
+
+
+def profile_version(user_pk):
+    """
+    Return the current version of the user's cached profile pages.
+
+    Pages are cached under keys that include the version, so bumping it
+    drops every page of the profile at once. A lost version restarts from
+    the current time, so pages cached under the old one are not reused.
+    """
+    cache = get_cache()
+    key = f"profile-version:{user_pk}"
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_profile(user_pk):
+    cache = get_cache()
+    try:
+        cache.incr(f"profile-version:{user_pk}")
+    except ValueError:
+        cache.add(f"profile-version:{user_pk}", time.time_ns(), None)
+
+
+def profile_key(user_pk, page):
+    """
+    Build the cache key of a profile page.
+
+    The key is built before the page is computed, so a page computed
+    while the profile is being invalidated is stored under the old
+    version and never served.
+    """
+    return f"profile:{user_pk}:{profile_version(user_pk)}:{page}"
+
+
+def get_profile(key):
+    return get_cache().get(key)
+
+
+def set_profile(key, page):
+    digest = hashlib.sha1(json.dumps(page, sort_keys=True).encode()).hexdigest()
+    get_cache().set(key, (page, digest), settings.PROFILE_CACHE_TTL)
+    return page, digest
+
+
+def profile_data(user, page, digest):
+    """
+    Return the profile data and ETag of a cached page of invitees.
+
+    Only the invitees are cached. The referral fields are taken from the
+    user of the request, so a page cached while they were changing is
+    not served with the old values for PROFILE_CACHE_TTL.
+    """
+    data = {
+        "users": page["users"],
+        "ref": user.ref,
+        "invited": user.inviter_id or "",
+        "count": user.invitee_count,
+        "next": page["next"]
+    }
+    etag = '"%s"' % hashlib.sha1(
+        f"{digest}:{data['ref']}:{data['invited']}:{data['count']}".encode()
+    ).hexdigest()
+    return data, etag
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_profile(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_profile(instance.pk)
@@ -0,0 +1,237 @@
+import bisect, threading, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+TIME_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+QUERY_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50, 100]
+
+
+class Switch:
+    """
+    Runtime on/off flag shared through the default cache.
+
+    Each process re-reads the flag at most once per PROFILING_REFRESH
+    seconds, so a disabled profiler costs one cache read per interval.
+    """
+
+    def __init__(self):
+        self.checked = None
+        self.value = False
+
+    def is_enabled(self):
+        now = time.monotonic()
+        if self.checked is None or now - self.checked >= settings.PROFILING_REFRESH:
+            self.value = cache.get("profiling-enabled", settings.PROFILING_ENABLED)
+            self.checked = now
+        return self.value
+
+    async def ais_enabled(self):
+        now = time.monotonic()
+        if self.checked is None or now - self.checked >= settings.PROFILING_REFRESH:
+            self.value = await cache.aget("profiling-enabled", settings.PROFILING_ENABLED)
+            self.checked = now
+        return self.value
+
+    def set(self, value):
+        cache.set("profiling-enabled", bool(value), None)
+        self.checked = None
+
+
+switch = Switch()
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        buckets = {str(bound): n for bound, n in zip(self.bounds, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {"count": self.count, "sum": round(self.sum, 3), "buckets": buckets}
+
+
+class Metrics:
+    """
+    Per-endpoint histograms of the profiled requests of this process.
+    """
+
+    FIELDS = {
+        "total_ms": TIME_BUCKETS,
+        "view_ms": TIME_BUCKETS,
+        "render_ms": TIME_BUCKETS,
+        "db_ms": TIME_BUCKETS,
+        "queries": QUERY_BUCKETS,
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def observe(self, endpoint, sample):
+        with self.lock:
+            histograms = self.endpoints.get(endpoint)
+            if histograms is None:
+                histograms = self.endpoints[endpoint] = {
+                    field: Histogram(bounds) for field, bounds in self.FIELDS.items()
+                }
+            for field, value in sample.items():
+                histograms[field].observe(value)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                endpoint: {field: h.as_dict() for field, h in histograms.items()}
+                for endpoint, histograms in self.endpoints.items()
+            }
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+
+metrics = Metrics()
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper counting queries and the time spent in them.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.duration += elapsed
+                self.queries += 1
+
+
+# The recorder of the request being profiled. Context variables are copied
+# into the threads that sync_to_async runs code in, so queries of sync
+# views and of the async ORM under ASGI reach the recorder of their
+# request, whichever thread and connection they run on.
+current_recorder = ContextVar("profiling_recorder", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def instrument(connection):
+    # Inserted first, as execute_wrapper() pops the last wrapper on exit.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    instrument(connection)
+
+
+class ProfilingMiddleware:
+    """
+    Measure query count, database time, view time and render time of each
+    request while profiling is switched on.
+
+    The timings are returned in a Server-Timing header and added to the
+    histograms served by /api/metrics/. The middleware runs natively under
+    both WSGI and ASGI, so it never forces async views into a thread.
+    Every connection carries record_query, which counts the queries of
+    the request whose recorder is in the current context.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not switch.is_enabled():
+            return self.get_response(request)
+        recorder = self.start(request)
+        with self.recording(recorder):
+            response = self.get_response(request)
+        return self.finish(request, response, recorder)
+
+    async def __acall__(self, request):
+        if not await switch.ais_enabled():
+            return await self.get_response(request)
+        recorder = self.start(request)
+        with self.recording(recorder):
+            response = await self.get_response(request)
+        return self.finish(request, response, recorder)
+
+    def start(self, request):
+        request.profiling = {"started": time.perf_counter()}
+        return QueryRecorder()
+
+    @contextmanager
+    def recording(self, recorder):
+        for connection in connections.all():
+            instrument(connection)
+        token = current_recorder.set(recorder)
+        try:
+            yield
+        finally:
+            current_recorder.reset(token)
+
+    def finish(self, request, response, recorder):
+        finished = time.perf_counter()
+        started = request.profiling["started"]
+        view_end = request.profiling.get("view_end", finished)
+        sample = {
+            "total_ms": (finished - started) * 1000,
+            "view_ms": (view_end - started) * 1000,
+            "render_ms": (request.profiling.get("render_end", view_end) - view_end) * 1000,
+            "db_ms": recorder.duration * 1000,
+            "queries": recorder.queries,
+        }
+        match = request.resolver_match
+        endpoint = f"{request.method} {match.route if match else 'unresolved'}"
+        metrics.observe(endpoint, sample)
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={sample["db_ms"]:.2f};desc="{recorder.queries} queries"',
+            f'view;dur={sample["view_ms"]:.2f}',
+            f'render;dur={sample["render_ms"]:.2f}',
+            f'total;dur={sample["total_ms"]:.2f}',
+        ])
+        return response
+
+    def process_template_response(self, request, response):
+        if hasattr(request, "profiling"):
+            request.profiling["view_end"] = time.perf_counter()
+            response.add_post_render_callback(
+                lambda r: request.profiling.__setitem__("render_end", time.perf_counter())
+            )
+        return response
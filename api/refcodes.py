@@ -0,0 +1,91 @@
+import hashlib, string, threading
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+
+ALPHABET = string.digits + string.ascii_letters
+LENGTH = 6
+SPACE = len(ALPHABET) ** LENGTH
+HALF_BITS = 18
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+
+def permute(number, key):
+    """
+    Map a sequence number to a unique number below SPACE.
+
+    A keyed Feistel network is a bijection on 36-bit integers. Values that
+    fall outside of SPACE are encrypted again (cycle walking), which keeps
+    the mapping a bijection on [0, SPACE).
+    """
+    while True:
+        left, right = number >> HALF_BITS, number & HALF_MASK
+        for i in range(ROUNDS):
+            digest = hashlib.blake2b(
+                right.to_bytes(3, "big") + bytes([i]), key=key, digest_size=4
+            ).digest()
+            left, right = right, left ^ (int.from_bytes(digest, "big") & HALF_MASK)
+        number = (left << HALF_BITS) | right
+        if number < SPACE:
+            return number
+
+
+def encode(number):
+    chars = []
+    for _ in range(LENGTH):
+        number, index = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[index])
+    return "".join(reversed(chars))
+
+
+class RefCodeAllocator:
+    """
+    Hand out referral codes that never collide with each other.
+
+    Sequence numbers are reserved from the database in blocks of
+    REF_CODE_BLOCK_SIZE, so a process writes to the sequence row once per
+    block rather than once per code. Each number is turned into a code by
+    a keyed permutation.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next = self.end = 0
+
+    @property
+    def key(self):
+        if not settings.REF_CODE_KEY:
+            raise ImproperlyConfigured("REF_CODE_KEY must be set.")
+        return hashlib.sha256(settings.REF_CODE_KEY.encode()).digest()
+
+    def reserve(self, count):
+        from .models import CodeSequence
+
+        with transaction.atomic():
+            sequence, _ = CodeSequence.objects.select_for_update().get_or_create(
+                name="ref"
+            )
+            start = sequence.value
+            sequence.value = start + count
+            sequence.save(update_fields=["value"])
+        if start + count > SPACE:
+            raise OverflowError("Referral code space is exhausted.")
+        return start, start + count
+
+    def next_code(self):
+        with self.lock:
+            if self.next == self.end:
+                self.next, self.end = self.reserve(settings.REF_CODE_BLOCK_SIZE)
+            number = self.next
+            self.next += 1
+        return encode(permute(number, self.key))
+
+    def allocate(self, count):
+        start, end = self.reserve(count)
+        key = self.key
+        return [encode(permute(number, key)) for number in range(start, end)]
+
+
+allocator = RefCodeAllocator()
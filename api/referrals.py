@@ -0,0 +1,167 @@
+from django.db import connections, router, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from . import events, leaderboard, profiles, routers
+from .authentication import invalidate_user
+from .models import User
+
+
+ACTIVATED = "activated"
+ALREADY_INVITED = "already_invited"
+CYCLE = "cycle"
+NOT_FOUND = "not_found"
+SELF_INVITE = "self_invite"
+
+
+def activate(user, ref_code):
+    """
+    Register ref_code as the referral code that invited the user.
+
+    The referral is written by one conditional UPDATE that only matches
+    while the user has no inviter and the code exists,
+    so of several concurrent activations exactly one succeeds. Only when
+    nothing was updated is the reason looked up. A successful activation
+    appends a ReferralEvent in the same transaction.
+
+    A code of the user's own downline is refused, as it would close a
+    cycle. The activation takes the lock of the event writers first, so
+    activations are checked and committed one at a time, and the walk up
+    the chain of the code sees every referral committed before it,
+    whatever the length of the cycle it would close.
+    """
+    if user.inviter_id is not None:
+        return ALREADY_INVITED
+    if ref_code == user.ref:
+        return SELF_INVITE
+    now = timezone.now()
+    with transaction.atomic():
+        events.lock()
+        updated = User.objects.filter(pk=user.pk, inviter__isnull=True).filter(
+            Exists(User.objects.filter(ref=ref_code))
+        ).update(inviter_id=ref_code, modified=now)
+        if not updated:
+            if User.objects.filter(pk=user.pk, inviter__isnull=False).exists():
+                return ALREADY_INVITED
+            return NOT_FOUND
+        if in_upline(user.ref, ref_code):
+            transaction.set_rollback(True)
+            return CYCLE
+        User.objects.filter(ref=ref_code).update(
+            invitee_count=F("invitee_count") + 1, modified=now
+        )
+        inviter_pk, score = User.objects.filter(ref=ref_code).values_list(
+            "pk", "invitee_count"
+        ).get()
+        leaderboard.move(score - 1, score)
+        events.record(user, ref_code, score, now)
+    user.inviter_id = ref_code
+    # The inviter's page is cached under its new version too, so it must
+    # not be rebuilt from a replica that has not seen the new invitee.
+    for pk in (user.pk, inviter_pk):
+        routers.pin(pk)
+        invalidate_user(pk)
+        profiles.invalidate_profile(pk)
+    return ACTIVATED
+
+
+def in_upline(ref, of):
+    """
+    Whether ref is the inviter of the code of, or of one of its inviters.
+
+    The chain is walked up by a recursive CTE. UNION drops rows already
+    seen, so the walk ends even on a cycle.
+    """
+    table = User._meta.db_table
+    ref_column = User._meta.get_field("ref").column
+    inviter = User._meta.get_field("inviter").column
+    sql = f"""
+        WITH RECURSIVE chain (ref) AS (
+            SELECT {inviter} FROM {table} WHERE {ref_column} = %s
+            UNION
+            SELECT u.{inviter} FROM {table} u JOIN chain ON u.{ref_column} = chain.ref
+        )
+        SELECT 1 FROM chain WHERE ref = %s
+    """
+    with connections[router.db_for_write(User)].cursor() as cursor:
+        cursor.execute(sql, [of, ref])
+        return cursor.fetchone() is not None
+
+
+def actual_invitee_count():
+    """
+    Expression counting the invitees of each row, for reconciling
+    User.invitee_count.
+    """
+    counts = User.objects.filter(inviter_id=OuterRef("ref")).order_by().values(
+        "inviter_id"
+    ).annotate(total=Count("pk")).values("total")
+    return Coalesce(Subquery(counts), 0)
+
+
+def subtree(user, depth, per_level):
+    """
+    Count the user's referrals down to the given depth and list up to
+    per_level usernames on each level.
+
+    The tree is walked by a recursive CTE over the inviter index, so the
+    whole subtree is read in one query whatever its depth. Each row
+    carries the codes on its path, and users already on it are not
+    visited again.
+    """
+    table = User._meta.db_table
+    username = User._meta.get_field("username").column
+    ref = User._meta.get_field("ref").column
+    inviter = User._meta.get_field("inviter").column
+    sql = f"""
+        WITH RECURSIVE tree (ref, username, level, path) AS (
+            SELECT {ref}, {username}, 1, ',' || {inviter} || ',' || {ref} || ','
+            FROM {table} WHERE {inviter} = %s
+            UNION ALL
+            SELECT u.{ref}, u.{username}, tree.level + 1, tree.path || u.{ref} || ','
+            FROM {table} u JOIN tree ON u.{inviter} = tree.ref
+            WHERE tree.level < %s AND tree.path NOT LIKE '%%,' || u.{ref} || ',%%'
+        )
+        SELECT level, username, level_count FROM (
+            SELECT level, username,
+                ROW_NUMBER() OVER (PARTITION BY level ORDER BY username) AS position,
+                COUNT(*) OVER (PARTITION BY level) AS level_count
+            FROM tree
+        ) ranked
+        WHERE position <= %s
+        ORDER BY level, username
+    """
+    levels = {}
+    with connections[router.db_for_read(User)].cursor() as cursor:
+        cursor.execute(sql, [user.ref, depth, per_level])
+        for level, name, count in cursor.fetchall():
+            entry = levels.setdefault(level, {"level": level, "count": count, "users": []})
+            entry["users"].append(name)
+    return {
+        "depth": depth,
+        "total": sum(entry["count"] for entry in levels.values()),
+        "levels": list(levels.values()),
+    }
+
+
+@receiver(pre_delete, sender=User)
+def invalidate_relatives(sender, instance, **kwargs):
+    """
+    Invalidate the cached tokens and profiles of the inviter and the
+    invitees of a deleted user once the deletion commits.
+
+    Their invitee count and inviter are changed by queryset updates and
+    SET_NULL, which send no post_save.
+    """
+    related = list(User.objects.filter(
+        Q(ref=instance.inviter_id) | Q(inviter_id=instance.ref)
+    ).values_list("pk", flat=True))
+
+    def invalidate():
+        for pk in related:
+            invalidate_user(pk)
+            profiles.invalidate_profile(pk)
+
+    transaction.on_commit(invalidate, using=router.db_for_write(User))
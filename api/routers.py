@@ -0,0 +1,92 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+
+replica_reads = ContextVar("replica_reads", default=False)
+
+
+@contextmanager
+def use_replicas():
+    """
+    Route the reads of the block to the replicas.
+    """
+    token = replica_reads.set(True)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+def pin(user_pk):
+    """
+    Keep the reads of a user on the primary for REPLICA_PIN_SECONDS, so
+    the user sees their own writes while the replicas catch up.
+    """
+    if settings.DATABASE_REPLICAS:
+        cache.set(f"replica-pin:{user_pk}", True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_pk):
+    return cache.get(f"replica-pin:{user_pk}", False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Send reads made inside use_replicas() to a random alias of
+    DATABASE_REPLICAS and everything else to the primary.
+
+    The replicas are expected to be copies of the primary, so nothing is
+    migrated on them.
+    """
+
+    def db_for_read(self, model, **hints):
+        if replica_reads.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Serve the safe requests of an API view from the replicas, unless the
+    user wrote recently.
+
+    Authentication still reads the primary, so a token issued a moment
+    ago is found. Views whose POST only reads can add it to
+    replica_methods.
+    """
+
+    replica_methods = SAFE_METHODS
+
+    def dispatch(self, request, *args, **kwargs):
+        # Threads serve many requests, so the routing of this one is
+        # undone even when the view raises.
+        token = replica_reads.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            replica_reads.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method in self.replica_methods
+            and not is_pinned(request.user.pk)
+        ):
+            replica_reads.set(True)
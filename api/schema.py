@@ -0,0 +1,155 @@
+import functools, gzip, hashlib, os
+from importlib.metadata import version as package_version
+from pathlib import Path
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from django.views import View
+
+
+# drf_yasg and the view descriptions of docs.py are imported by the
+# first schema generation, so processes serving prebuilt artifacts
+# never load them.
+
+FORMATS = {
+    ".json": ("OpenAPICodecJson", "application/json"),
+    ".yaml": ("OpenAPICodecYaml", "application/yaml"),
+}
+
+
+@functools.lru_cache
+def get_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Referral API",
+        default_version='v1',
+        description="Test project for Hammer Systems",
+        #terms_of_service="https://www.google.com/policies/terms/",
+        contact=openapi.Contact(email="advixum@gmail.com"),
+        license=openapi.License(name="AGPL-3.0 license"),
+    )
+
+
+@functools.lru_cache
+def get_schema_view():
+    from drf_yasg import views
+    from rest_framework import permissions
+    from . import docs  # noqa: F401
+
+    return views.get_schema_view(
+        get_info(),
+        public=True,
+        permission_classes=(permissions.AllowAny,),
+    )
+
+
+@functools.lru_cache
+def code_version():
+    """
+    Return SCHEMA_VERSION, or a digest of the API sources and of the
+    versions of the packages generating the schema.
+    """
+    if settings.SCHEMA_VERSION:
+        return settings.SCHEMA_VERSION
+    digest = hashlib.sha1()
+    for package in ("django", "djangorestframework", "drf-yasg"):
+        digest.update(package_version(package).encode())
+    root = Path(__file__).resolve().parent
+    for path in sorted(root.rglob("*.py")):
+        digest.update(str(path.relative_to(root)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def build(fmt):
+    """
+    Generate the schema in the given format and return it gzipped.
+    """
+    from drf_yasg import codecs
+    from drf_yasg.generators import OpenAPISchemaGenerator
+    from . import docs  # noqa: F401
+
+    codec = getattr(codecs, FORMATS[fmt][0])
+    schema = OpenAPISchemaGenerator(get_info()).get_schema(request=None, public=True)
+    return gzip.compress(codec(validators=[]).encode(schema), mtime=0)
+
+
+def artifact_path(fmt):
+    return Path(settings.SCHEMA_ARTIFACT_DIR) / f"openapi-{code_version()}{fmt}.gz"
+
+
+def write_artifact(fmt, data):
+    path = artifact_path(fmt)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temporary.write_bytes(data)
+    temporary.replace(path)
+    return path
+
+
+def get_artifact(fmt):
+    """
+    Return the gzipped schema of the current code version.
+
+    It is looked up in the cache, then in SCHEMA_ARTIFACT_DIR, where
+    build_schema puts it at deploy time, and generated by the first
+    request that finds neither.
+    """
+    key = f"openapi:{code_version()}:{fmt}"
+    data = cache.get(key)
+    if data is None:
+        try:
+            data = artifact_path(fmt).read_bytes()
+        except FileNotFoundError:
+            data = build(fmt)
+            try:
+                write_artifact(fmt, data)
+            except OSError:
+                pass
+        cache.set(key, data, None)
+    return data
+
+
+def ui_view(renderer):
+    """
+    Return the drf_yasg UI view of renderer, with its pages cached under
+    the code version. The view is built by its first request.
+    """
+    @functools.lru_cache
+    def cached_view():
+        return get_schema_view().with_ui(
+            renderer,
+            cache_timeout=settings.SCHEMA_CACHE_TTL,
+            cache_kwargs={"key_prefix": f"openapi-ui:{code_version()}"}
+        )
+
+    def view(request, *args, **kwargs):
+        return cached_view()(request, *args, **kwargs)
+
+    return view
+
+
+class SchemaFileView(View):
+    """
+    Serve the prebuilt schema, gzipped when the client accepts it.
+    """
+
+    def get(self, request, format):
+        if format not in FORMATS:
+            raise Http404
+        etag = f'"{code_version()}"'
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+        else:
+            data = get_artifact(format)
+            response = HttpResponse(content_type=FORMATS[format][1])
+            if "gzip" in request.headers.get("Accept-Encoding", ""):
+                response["Content-Encoding"] = "gzip"
+            else:
+                data = gzip.decompress(data)
+            response.content = data
+        response["ETag"] = etag
+        response["Vary"] = "Accept-Encoding"
+        return response
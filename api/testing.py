@@ -0,0 +1,34 @@
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetContext(CaptureQueriesContext):
+    def __init__(self, test_case, budget, connection):
+        self.test_case = test_case
+        self.budget = budget
+        super().__init__(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        queries = "\n".join(
+            f"{i}. {query['sql']}" for i, query in enumerate(self.captured_queries, start=1)
+        )
+        self.test_case.assertLessEqual(
+            len(self), self.budget,
+            f"{len(self)} queries executed, at most {self.budget} expected\n"
+            f"Captured queries were:\n{queries}"
+        )
+
+
+class QueryBudgetMixin:
+    """
+    Test case mixin asserting an upper bound on the number of queries.
+
+        with self.assertMaxQueries(2):
+            self.client.get("/api/data/")
+    """
+
+    def assertMaxQueries(self, budget, using="default"):
+        return QueryBudgetContext(self, budget, connections[using])
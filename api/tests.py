@@ -1,11 +1,46 @@
+import asyncio, gzip, importlib, json, os, random, tempfile, threading, time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
-from .models import User
+from . import accounts, events, export, idempotency, otp, profiling, referrals, refcodes, routers, throttling
+from .authentication import get_token_cache, invalidate_user
+from .management.commands import bench_async, loadtest
+from .management.commands.loadtest import Command as LoadtestCommand
+from .models import DeletedUser, OneTimeCode, ReferralEvent, User
+from .testing import QueryBudgetMixin
 
 
 # Create your tests here.
 
+# Rate limits are switched off for the module, as the tests send many
+# requests for the same phone number. ThrottlingTests enables them. Reads
+# stay on the primary unless a test routes them to replicas.
+module_override = override_settings(THROTTLE_RATES={}, DATABASE_REPLICAS=[])
+
+
+def setUpModule():
+    module_override.enable()
+
+
+def tearDownModule():
+    module_override.disable()
+
+
+@override_settings(OTP_EXPOSE_CODE=True)
 class LoginViewTests(APITestCase):
     def test_invalid_phone_login(self):
         """
@@ -39,6 +74,15 @@ class LoginViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data["code"]), 4)
 
+    @override_settings(OTP_EXPOSE_CODE=False)
+    def test_code_not_exposed(self):
+        """
+        The verification code was left out of the response unless exposed.
+        """
+        response = self.client.post("/api/login/", {"phone": "+7 (123) 456-78-90"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("code", response.data)
+
     def test_response_code(self):
         """
         The verification code sent in different requests was unique.
@@ -49,23 +93,113 @@ class LoginViewTests(APITestCase):
         self.assertEqual(response2.status_code, status.HTTP_200_OK)
         self.assertNotEqual(response1.data["code"], response2.data["code"])
 
+    def test_login_does_not_wait_for_delivery(self):
+        """
+        The login response was returned before the code was delivered.
+        """
+        started = time.monotonic()
+        response = self.client.post("/api/login/", {"phone": "+7 (123) 456-78-90"})
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("ticket", response.data)
+
+class DeliveryStatusViewTests(APITestCase):
+    @override_settings(SMS_DELIVERY_BACKEND="api.delivery.SyncBackend", SMS_STUB_DELAY=0)
+    def test_sent_ticket_status(self):
+        """
+        The status of a delivered code was reported as sent.
+        """
+        response = self.client.post("/api/login/", {"phone": "+7 (123) 456-78-90"})
+        ticket = response.data["ticket"]
+        response = self.client.get(f"/api/delivery/{ticket}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["ticket"], ticket)
+        self.assertEqual(response.data["status"], "sent")
+        self.assertIsNotNone(response.data["sent_at"])
+
+    def test_unknown_ticket_status(self):
+        """
+        The status request for an unknown ticket was rejected.
+        """
+        response = self.client.get("/api/delivery/unknown/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data, {"message": "Ticket not found."})
+
+@override_settings(OTP_EXPOSE_CODE=True)
 class VerifyViewTests(APITestCase):
+    def login(self, phone):
+        response = self.client.post("/api/login/", {"phone": phone})
+        return response.data["code"]
+
     def test_invalid_code_response(self):
         """
         Invalid code was rejected.
         """
-        data = {"phone": "+7 (123) 456-78-90", "code": "1234", "verify": "5678"}
+        code = self.login("+7 (123) 456-78-90")
+        wrong = "0000" if code != "0000" else "1111"
+        data = {"phone": "+7 (123) 456-78-90", "verify": wrong}
         response = self.client.post("/api/verify/", data, format="json")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data, {"message": "Invalid code."})
 
+    def test_code_not_issued_response(self):
+        """
+        A code that was never sent to the phone number was rejected.
+        """
+        data = {"phone": "+7 (123) 456-78-90", "code": "1234", "verify": "1234"}
+        response = self.client.post("/api/verify/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {"message": "Invalid code."})
+
+    def test_code_single_use(self):
+        """
+        A code that was already used was rejected.
+        """
+        code = self.login("+7 (123) 456-78-90")
+        data = {"phone": "+7 (123) 456-78-90", "verify": code}
+        response = self.client.post("/api/verify/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post("/api/verify/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(OTP_TTL=0)
+    def test_expired_code_response(self):
+        """
+        An expired code was rejected.
+        """
+        code = self.login("+7 (123) 456-78-90")
+        data = {"phone": "+7 (123) 456-78-90", "verify": code}
+        response = self.client.post("/api/verify/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {"message": "Code expired."})
+
+    @override_settings(OTP_MAX_ATTEMPTS=2)
+    def test_attempts_limit(self):
+        """
+        The code was locked after too many wrong guesses, until a new one
+        was requested.
+        """
+        code = self.login("+7 (123) 456-78-90")
+        wrong = "0000" if code != "0000" else "1111"
+        for guess in (wrong, wrong):
+            data = {"phone": "+7 (123) 456-78-90", "verify": guess}
+            response = self.client.post("/api/verify/", data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        data = {"phone": "+7 (123) 456-78-90", "verify": code}
+        response = self.client.post("/api/verify/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        data["verify"] = self.login("+7 (123) 456-78-90")
+        response = self.client.post("/api/verify/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
     def test_successful_login_response(self):
         """
         Login attempt with an existing phone number was successful.
         """
         user = User.objects.create_user(username="71234567890")
         user.save()
-        data = {"phone": "+7 (123) 456-78-90", "code": "1234", "verify": "1234"}
+        code = self.login("+7 (123) 456-78-90")
+        data = {"phone": "+7 (123) 456-78-90", "code": code, "verify": code}
         response = self.client.post("/api/verify/", data, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["message"], "Login successful.")
@@ -76,18 +210,140 @@ class VerifyViewTests(APITestCase):
         Registration and login attempt with a non-existent phone number
         was successful. 
         """
-        data = {"phone": "+7 (123) 000-00-00", "code": "1234", "verify": "1234"}
+        code = self.login("+7 (123) 000-00-00")
+        data = {"phone": "+7 (123) 000-00-00", "code": code, "verify": code}
         response = self.client.post("/api/verify/", data, format="json")
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.data["message"], "User created and logged in.")
         self.assertIn("token", response.data)
 
+    def test_idempotent_retry(self):
+        """
+        A retry with the same Idempotency-Key got the stored response,
+        while a new key had to verify the used code again.
+        """
+        code = self.login("+7 (123) 000-00-00")
+        data = {"phone": "+7 (123) 000-00-00", "verify": code}
+        headers = {"Idempotency-Key": "retry-1"}
+        response = self.client.post("/api/verify/", data, format="json", headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        retry = self.client.post("/api/verify/", data, format="json", headers=headers)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, response.data)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        headers = {"Idempotency-Key": "retry-2"}
+        response = self.client.post("/api/verify/", data, format="json", headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_idempotent_retry_after_rotation(self):
+        """
+        The stored response kept no token, and a retry after the token
+        was replaced was not answered with either token.
+        """
+        code = self.login("+7 (123) 000-00-00")
+        data = {"phone": "+7 (123) 000-00-00", "verify": code}
+        headers = {"Idempotency-Key": "retry-1"}
+        response = self.client.post("/api/verify/", data, format="json", headers=headers)
+        token = response.data["token"]
+        self.assertNotIn(token, str(cache.get(idempotency.make_key(
+            "verify", mock.Mock(headers=headers), "71230000000", code
+        ))))
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        self.client.post("/api/token/rotate/")
+        self.client.credentials()
+        retry = self.client.post("/api/verify/", data, format="json", headers=headers)
+        self.assertEqual(retry.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn("token", retry.data)
+
+    @override_settings(OTP_MAX_ATTEMPTS=2)
+    def test_idempotent_guesses_counted(self):
+        """
+        Wrong guesses sent with an Idempotency-Key used up the attempts.
+        """
+        code = self.login("+7 (123) 000-00-00")
+        wrong = "0000" if code != "0000" else "1111"
+        headers = {"Idempotency-Key": "retry-1"}
+        for guess in (wrong, wrong, code):
+            data = {"phone": "+7 (123) 000-00-00", "verify": guess}
+            response = self.client.post("/api/verify/", data, format="json", headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_repeated_log_in(self):
+        """
+        Logging in twice kept one user and one token and only created the
+        user the first time.
+        """
+        key, created = accounts.log_in("71234567890")
+        self.assertTrue(created)
+        self.assertEqual(accounts.log_in("71234567890"), (key, False))
+        user = User.objects.get(username="71234567890")
+        self.assertEqual(user.auth_token.key, key)
+        self.assertTrue(user.ref)
+        self.assertIsNotNone(user.last_login)
+
+class OTPStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def check_store(self, store):
+        store.issue("71234567890", "1234")
+        self.assertEqual(store.verify("71234567890", "0000"), otp.INVALID)
+        self.assertEqual(store.verify("71234567890", "1234"), otp.VALID)
+        self.assertEqual(store.verify("71234567890", "1234"), otp.MISSING)
+        store.issue("71234567890", "1234")
+        for _ in range(store.max_attempts):
+            self.assertEqual(store.verify("71234567890", "0000"), otp.INVALID)
+        self.assertEqual(store.verify("71234567890", "1234"), otp.LOCKED)
+        self.assertEqual(store.verify("71234567890", "1234"), otp.LOCKED)
+
+    def test_memory_store(self):
+        """
+        The in-memory store accepted a code once.
+        """
+        self.check_store(otp.MemoryOTPStore())
+
+    def test_database_store(self):
+        """
+        The database store accepted a code once.
+        """
+        self.check_store(otp.DatabaseOTPStore())
+
+    def test_cache_store(self):
+        """
+        The cache store accepted a code once.
+        """
+        self.check_store(otp.CacheOTPStore())
+
+    def test_cache_store_single_use(self):
+        """
+        Two requests that both read the code before either used it did
+        not both succeed.
+        """
+        store = otp.CacheOTPStore()
+        store.issue("71234567890", "1234")
+        entry = store.cache.get("otp:71234567890")
+        with mock.patch.object(store.cache, "get", return_value=entry):
+            self.assertEqual(store.verify("71234567890", "1234"), otp.VALID)
+            store.cache.set("otp-attempts:71234567890", 1)
+            self.assertEqual(store.verify("71234567890", "1234"), otp.MISSING)
+
+    @override_settings(OTP_TTL=0)
+    def test_cleanup(self):
+        """
+        Expired codes were deleted by the cleanup.
+        """
+        for store in (otp.MemoryOTPStore(), otp.DatabaseOTPStore()):
+            store.issue("71234567890", "1234")
+            self.assertEqual(store.cleanup(), 1)
+            self.assertEqual(store.verify("71234567890", "1234"), otp.MISSING)
+
 class DataViewTests(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user1 = User.objects.create_user(username="11111111111")
         self.user2 = User.objects.create_user(username="22222222222")
         self.user3 = User.objects.create_user(username="33333333333")
-        self.user2.invited = self.user1.ref
+        self.user2.inviter = self.user1
         self.user2.save()
         self.token1 = Token.objects.create(user=self.user1)
         self.token2 = Token.objects.create(user=self.user2)
@@ -231,3 +487,1251 @@ class DataViewTests(APITestCase):
         response = self.client.post("/api/data/", data={"ref_code": ""})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data["message"], "Referral code is required.")
+
+class DataViewPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.inviter = User.objects.create_user(username="10000000000")
+        for i in range(1, 6):
+            User.objects.create_user(username=f"2000000000{i}", inviter=self.inviter)
+        token = Token.objects.create(user=self.inviter)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def test_keyset_pages(self):
+        """
+        The invitee list was returned page by page following the cursor.
+        """
+        response = self.client.get("/api/data/", {"limit": 2})
+        self.assertEqual(response.data["users"], ["20000000001", "20000000002"])
+        self.assertEqual(response.data["next"], "20000000002")
+        response = self.client.get("/api/data/", {"limit": 2, "after": "20000000004"})
+        self.assertEqual(response.data["users"], ["20000000005"])
+        self.assertIsNone(response.data["next"])
+
+    def test_invalid_limit(self):
+        """
+        A page size out of the allowed range was rejected.
+        """
+        response = self.client.get("/api/data/", {"limit": 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ndjson_stream(self):
+        """
+        The full invitee list was streamed as NDJSON.
+        """
+        response = self.client.get("/api/data/", {"stream": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [f'"2000000000{i}"' for i in range(1, 6)])
+
+class RefCodeAllocatorTests(TestCase):
+    def test_permutation_is_collision_free(self):
+        """
+        Consecutive sequence numbers were mapped to distinct valid codes.
+        """
+        key = refcodes.allocator.key
+        codes = {refcodes.encode(refcodes.permute(n, key)) for n in range(20000)}
+        self.assertEqual(len(codes), 20000)
+        for code in codes:
+            self.assertEqual(len(code), 6)
+            self.assertTrue(set(code) <= set(refcodes.ALPHABET))
+
+    def test_key_independent_of_secret_key(self):
+        """
+        Rotating SECRET_KEY left the code permutation unchanged.
+        """
+        key = refcodes.allocator.key
+        with override_settings(SECRET_KEY="rotated"):
+            self.assertEqual(refcodes.allocator.key, key)
+        with override_settings(REF_CODE_KEY=""):
+            with self.assertRaises(ImproperlyConfigured):
+                refcodes.allocator.key
+
+    def test_block_reservation(self):
+        """
+        Codes were handed out from a single reserved block.
+        """
+        allocator = refcodes.RefCodeAllocator()
+        with self.assertNumQueries(0):
+            allocator.next, allocator.end = 0, 3
+            codes = [allocator.next_code() for _ in range(3)]
+        self.assertEqual(len(set(codes)), 3)
+        self.assertEqual(len(set(allocator.allocate(50))), 50)
+
+    def test_signup_skips_taken_code(self):
+        """
+        A code already taken by another user was skipped on signup.
+        """
+        taken = User.objects.create_user(username="11111111111")
+        with mock.patch.object(
+            refcodes.allocator, "next_code", side_effect=[taken.ref, "zzzzzz"]
+        ):
+            user = User.objects.create_user(username="22222222222")
+        self.assertEqual(user.ref, "zzzzzz")
+        self.assertEqual(User.objects.count(), 2)
+
+class ImportUsersCommandTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, content):
+        path = Path(self.tmp.name) / name
+        path.write_text(content)
+        return path
+
+    def test_csv_import(self):
+        """
+        Users and tokens were created for valid phone numbers from CSV.
+        """
+        User.objects.create_user(username="71111111111")
+        path = self.write("users.csv", "phone\n+7 (111) 111-11-11\n72222222222\nbad\n73333333333\n")
+        call_command("import_users", path, batch_size=2, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(Token.objects.count(), 3)
+        self.assertEqual(len(set(User.objects.values_list("ref", flat=True))), 3)
+
+    def test_ndjson_resume(self):
+        """
+        A resumed NDJSON import skipped the records imported before.
+        """
+        path = self.write("users.ndjson", '{"phone": "72222222222"}\n"73333333333"\n')
+        self.write("users.ndjson.state", json.dumps({"records": 1}))
+        call_command("import_users", path, resume=True, stdout=StringIO())
+        self.assertEqual(list(User.objects.values_list("username", flat=True)), ["73333333333"])
+        call_command("import_users", path, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 2)
+        self.assertEqual(Token.objects.count(), 2)
+
+class CachedTokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="11111111111")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.addCleanup(get_token_cache().delete, self.token.key)
+
+    def test_cached_token_skips_lookup(self):
+        """
+        A repeated request was authenticated without querying the token.
+        """
+        self.client.get("/api/data/")
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/data/", {"limit": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deleted_token_rejected(self):
+        """
+        A deleted token was rejected although it had been cached.
+        """
+        self.client.get("/api/data/")
+        self.token.delete()
+        response = self.client.get("/api/data/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_saved_user_refreshed(self):
+        """
+        Changes to the user were visible to the next cached request.
+        """
+        self.client.get("/api/data/")
+        inviter = User.objects.create_user(username="22222222222")
+        self.user.inviter = inviter
+        self.user.save()
+        response = self.client.get("/api/data/")
+        self.assertEqual(response.data["invited"], inviter.ref)
+
+    def test_deleted_relatives_refreshed(self):
+        """
+        The inviter and the invitees of a deleted user saw the changed
+        counter and inviter in their next cached requests.
+        """
+        inviter = User.objects.create_user(username="22222222222")
+        invitee = User.objects.create_user(username="33333333333")
+        referrals.activate(self.user, inviter.ref)
+        referrals.activate(invitee, self.user.ref)
+        tokens = {user: Token.objects.create(user=user).key for user in (inviter, invitee)}
+        for key in tokens.values():
+            self.client.credentials(HTTP_AUTHORIZATION=f"Token {key}")
+            self.client.get("/api/data/")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {tokens[inviter]}")
+        self.assertEqual(self.client.get("/api/data/").data["count"], 0)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {tokens[invitee]}")
+        self.assertEqual(self.client.get("/api/data/").data["invited"], "")
+
+class TokenLifecycleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="11111111111")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.addCleanup(get_token_cache().delete, self.token.key)
+
+    def age(self, key, days):
+        Token.objects.filter(key=key).update(created=timezone.now() - timedelta(days=days))
+
+    def test_expired_token_rejected(self):
+        """
+        A token past TOKEN_TTL was rejected, also when it was cached.
+        """
+        self.assertEqual(self.client.get("/api/data/").status_code, status.HTTP_200_OK)
+        with override_settings(TOKEN_TTL=0):
+            response = self.client.get("/api/data/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        get_token_cache().delete(self.token.key)
+        self.age(self.token.key, 31)
+        response = self.client.get("/api/data/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_used_token_refreshed(self):
+        """
+        Using a token older than TOKEN_REFRESH_INTERVAL restarted its lifetime.
+        """
+        self.age(self.token.key, 29)
+        self.assertEqual(self.client.get("/api/data/").status_code, status.HTTP_200_OK)
+        self.token.refresh_from_db()
+        self.assertGreater(self.token.created, timezone.now() - timedelta(minutes=1))
+
+    def test_expired_token_replaced_on_login(self):
+        """
+        Logging in again issued a new token instead of the expired one.
+        """
+        self.age(self.token.key, 31)
+        key, created = accounts.log_in(self.user.username)
+        self.assertFalse(created)
+        self.assertNotEqual(key, self.token.key)
+        self.assertEqual(Token.objects.get(user=self.user).key, key)
+
+    def test_rotate(self):
+        """
+        The rotated token replaced the old one, which stopped working.
+        """
+        response = self.client.post("/api/token/rotate/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get("/api/data/").status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {response.data['token']}")
+        self.assertEqual(self.client.get("/api/data/").status_code, status.HTTP_200_OK)
+
+    async def test_async_expired_token_rejected(self):
+        """
+        The async views rejected an expired token.
+        """
+        headers = {"Authorization": f"Token {self.token.key}"}
+        await Token.objects.filter(key=self.token.key).aupdate(
+            created=timezone.now() - timedelta(days=31)
+        )
+        response = await self.async_client.get("/api/async/data/", headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_prune(self):
+        """
+        Expired tokens were deleted in batches and live ones were kept.
+        """
+        users = [User.objects.create_user(username=f"2000000000{i}") for i in range(5)]
+        tokens = [Token.objects.create(user=user) for user in users]
+        for token in tokens[:3]:
+            self.age(token.key, 31)
+        out = StringIO()
+        call_command("prune_tokens", batch_size=2, stdout=out)
+        self.assertIn("Deleted 3 expired tokens.", out.getvalue())
+        self.assertEqual(
+            set(Token.objects.values_list("key", flat=True)),
+            {self.token.key, *(token.key for token in tokens[3:])}
+        )
+
+class ProfileCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.inviter = User.objects.create_user(username="11111111111")
+        self.invitee = User.objects.create_user(username="22222222222")
+        self.inviter_token = Token.objects.create(user=self.inviter)
+        self.invitee_token = Token.objects.create(user=self.invitee)
+
+    def test_cached_profile(self):
+        """
+        A repeated profile request was served without database queries.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.inviter_token.key}")
+        first = self.client.get("/api/data/")
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/data/")
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_not_modified(self):
+        """
+        A profile request with a matching ETag was answered with 304.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.inviter_token.key}")
+        etag = self.client.get("/api/data/")["ETag"]
+        response = self.client.get("/api/data/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+    def test_referral_invalidates_inviter(self):
+        """
+        The inviter's cached profile was refreshed after a referral.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.inviter_token.key}")
+        etag = self.client.get("/api/data/")["ETag"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.invitee_token.key}")
+        self.client.post("/api/data/", data={"ref_code": self.inviter.ref})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.inviter_token.key}")
+        response = self.client.get("/api/data/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["users"], [self.invitee.username])
+
+    def test_cached_page_fresh_counters(self):
+        """
+        A cached page was served with the current invitee count of the
+        user and a new ETag.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.inviter_token.key}")
+        etag = self.client.get("/api/data/")["ETag"]
+        User.objects.filter(pk=self.inviter.pk).update(invitee_count=5)
+        invalidate_user(self.inviter.pk)
+        response = self.client.get("/api/data/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 5)
+
+@override_settings(OTP_EXPOSE_CODE=True)
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(SMS_DELIVERY_BACKEND="api.delivery.SyncBackend", SMS_STUB_DELAY=0)
+    async def test_async_auth_flow(self):
+        """
+        Login, verification and referral registration succeeded through
+        the async views.
+        """
+        inviter = await User.objects.acreate(username="11111111111")
+        response = await self.async_client.post(
+            "/api/async/login/", {"phone": "+7 (123) 456-78-90"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        code = response.json()["code"]
+        response = await self.async_client.post(
+            "/api/async/verify/", {"phone": "71234567890", "verify": code}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        headers = {"Authorization": f"Token {response.json()['token']}"}
+        response = await self.async_client.post(
+            "/api/async/data/", {"ref_code": inviter.ref}, content_type="application/json", headers=headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["invited"], inviter.ref)
+        response = await self.async_client.get("/api/async/data/", headers=headers)
+        self.assertEqual(response.json()["invited"], inviter.ref)
+        self.assertEqual(response.json()["users"], [])
+
+    async def test_async_data_requires_token(self):
+        """
+        Unauthorized async profile request was rejected.
+        """
+        response = await self.async_client.get("/api/async/data/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class ProfilingTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        profiling.metrics.reset()
+        self.user = User.objects.create_user(username="11111111111")
+        self.token = Token.objects.create(user=self.user)
+        self.admin = User.objects.create_user(username="99999999999", is_staff=True)
+        self.admin_token = Token.objects.create(user=self.admin)
+
+    def test_data_get_query_budget(self):
+        """
+        An uncached profile request used at most two queries.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        with self.assertMaxQueries(2):
+            response = self.client.get("/api/data/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_server_timing_and_metrics(self):
+        """
+        Profiled requests reported Server-Timing and were aggregated.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.admin_token.key}")
+        response = self.client.post("/api/metrics/", {"enabled": True}, format="json")
+        self.assertTrue(response.data["enabled"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        response = self.client.get("/api/data/")
+        self.assertIn('desc="2 queries"', response["Server-Timing"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.admin_token.key}")
+        response = self.client.get("/api/metrics/")
+        endpoint = response.data["endpoints"]["GET api/data/"]
+        self.assertEqual(endpoint["queries"]["count"], 1)
+        self.assertEqual(endpoint["queries"]["buckets"]["2"], 1)
+        self.client.post("/api/metrics/", {"enabled": False}, format="json")
+        response = self.client.get("/api/data/")
+        self.assertNotIn("Server-Timing", response)
+
+    @override_settings(SMS_DELIVERY_BACKEND="api.delivery.SyncBackend", SMS_STUB_DELAY=0.3)
+    async def test_async_views_stay_concurrent(self):
+        """
+        Async views served through the middleware overlapped instead of
+        being run one at a time, whether profiling was on or off.
+        """
+        for enabled in (False, True):
+            profiling.switch.set(enabled)
+            started = time.perf_counter()
+            responses = await asyncio.gather(*[
+                self.async_client.post(
+                    "/api/async/login/", {"phone": f"7000000000{i}"}, content_type="application/json"
+                )
+                for i in range(5)
+            ])
+            self.assertLess(time.perf_counter() - started, 1.0)
+            self.assertEqual([r.status_code for r in responses], [status.HTTP_200_OK] * 5)
+            self.assertEqual(all("Server-Timing" in r for r in responses), enabled)
+        profiling.switch.set(False)
+
+    async def test_async_queries_counted(self):
+        """
+        Queries run in executor threads under ASGI were counted for the
+        request that ran them.
+        """
+        profiling.switch.set(True)
+        headers = {"Authorization": f"Token {self.token.key}"}
+        for path in ("/api/data/", "/api/async/data/"):
+            response = await self.async_client.get(path, {"limit": len(path)}, headers=headers)
+            self.assertRegex(response["Server-Timing"], r'desc="[1-9]\d* queries"')
+        profiling.switch.set(False)
+
+    def test_metrics_require_admin(self):
+        """
+        A non-admin user could not view the metrics.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class ReferralTreeTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.root = User.objects.create_user(username="10000000000")
+        first = [
+            User.objects.create_user(username=f"2000000000{i}", inviter=self.root)
+            for i in range(2)
+        ]
+        second = User.objects.create_user(username="30000000000", inviter=first[0])
+        User.objects.create_user(username="40000000000", inviter=second)
+        token = Token.objects.create(user=self.root)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.client.get("/api/data/tree/")
+
+    def test_subtree_levels(self):
+        """
+        The referral tree was counted level by level in one query.
+        """
+        with self.assertMaxQueries(1):
+            response = self.client.get("/api/data/tree/", {"depth": 3, "limit": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["total"], 4)
+        self.assertEqual(response.data["levels"], [
+            {"level": 1, "count": 2, "users": ["20000000000"]},
+            {"level": 2, "count": 1, "users": ["30000000000"]},
+            {"level": 3, "count": 1, "users": ["40000000000"]},
+        ])
+
+    def test_subtree_depth_limit(self):
+        """
+        Levels deeper than requested were not counted.
+        """
+        response = self.client.get("/api/data/tree/", {"depth": 1})
+        self.assertEqual(response.data["total"], 2)
+        response = self.client.get("/api/data/tree/", {"depth": 99})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cycle_refused(self):
+        """
+        Users could not register the code of their own invitee or of a
+        deeper referral.
+        """
+        for username in ("20000000000", "30000000000", "40000000000"):
+            invitee = User.objects.get(username=username)
+            self.assertEqual(referrals.activate(self.root, invitee.ref), referrals.CYCLE)
+        self.root.refresh_from_db()
+        self.assertIsNone(self.root.inviter_id)
+        first, second = (User.objects.create_user(username=f"5000000000{i}") for i in range(2))
+        self.assertEqual(referrals.activate(first, second.ref), referrals.ACTIVATED)
+        token = Token.objects.create(user=second)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        response = self.client.post("/api/data/", data={"ref_code": first.ref})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(User.objects.get(pk=second.pk).invitee_count, 1)
+
+    def test_subtree_with_cycle(self):
+        """
+        A cycle written around the activation was walked once.
+        """
+        first = User.objects.get(username="20000000000")
+        User.objects.filter(pk=self.root.pk).update(inviter_id=first.ref)
+        response = self.client.get("/api/data/tree/", {"depth": 5})
+        self.assertEqual(response.data["total"], 4)
+        self.assertEqual(response.data["levels"][-1]["level"], 3)
+
+class InviteeCountTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.inviter = User.objects.create_user(username="11111111111")
+        self.invitee = User.objects.create_user(username="22222222222")
+        self.inviter_token = Token.objects.create(user=self.inviter)
+        self.invitee_token = Token.objects.create(user=self.invitee)
+
+    def test_referral_increments_count(self):
+        """
+        Registering a referral increased the inviter's counter.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.inviter_token.key}")
+        self.client.get("/api/data/", {"count_only": 1})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.invitee_token.key}")
+        self.client.post("/api/data/", data={"ref_code": self.inviter.ref})
+        self.inviter.refresh_from_db()
+        self.assertEqual(self.inviter.invitee_count, 1)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.inviter_token.key}")
+        with self.assertMaxQueries(1):
+            response = self.client.get("/api/data/", {"count_only": 1})
+        self.assertEqual(response.data, {"ref": self.inviter.ref, "invited": "", "count": 1})
+
+    def test_deleted_invitee_decrements_count(self):
+        """
+        Deleting an invitee decreased the inviter's counter.
+        """
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.invitee_token.key}")
+        self.client.post("/api/data/", data={"ref_code": self.inviter.ref})
+        self.invitee.refresh_from_db()
+        self.invitee.delete()
+        self.inviter.refresh_from_db()
+        self.assertEqual(self.inviter.invitee_count, 0)
+
+    def test_reconcile_command(self):
+        """
+        Drifted counters were fixed by the reconcile command.
+        """
+        User.objects.filter(pk=self.invitee.pk).update(inviter_id=self.inviter.ref)
+        User.objects.filter(pk=self.invitee.pk).update(invitee_count=5)
+        out = StringIO()
+        call_command("reconcile_invitee_counts", batch_size=1, stdout=out)
+        self.assertIn("Fixed 2 invitee counts.", out.getvalue())
+        self.assertEqual(
+            dict(User.objects.values_list("username", "invitee_count")),
+            {"11111111111": 1, "22222222222": 0}
+        )
+
+class LeaderboardTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f"5000000000{i}") for i in range(4)]
+        for user, count in zip(self.users, [3, 5, 3, 0]):
+            User.objects.filter(pk=user.pk).update(invitee_count=count)
+        call_command("refresh_leaderboard", stdout=StringIO())
+        self.token = Token.objects.create(user=self.users[0])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def refs(self, *indexes):
+        return [User.objects.get(pk=self.users[i].pk).ref for i in indexes]
+
+    def test_top_and_rank(self):
+        """
+        Referrers were ranked by invitee count, sharing ranks on ties.
+        """
+        response = self.client.get("/api/leaderboard/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first, second, third = self.refs(1, 0, 2)
+        self.assertEqual(response.data["top"], [
+            {"rank": 1, "ref": first, "count": 5},
+            {"rank": 2, "ref": second, "count": 3},
+            {"rank": 2, "ref": third, "count": 3},
+        ])
+        self.assertEqual((response.data["count"], response.data["rank"]), (3, 2))
+        with self.assertMaxQueries(2):
+            response = self.client.get("/api/leaderboard/", {"ref": first})
+        self.assertEqual((response.data["count"], response.data["rank"]), (5, 1))
+        response = self.client.get("/api/leaderboard/", {"limit": 1})
+        self.assertEqual(len(response.data["top"]), 1)
+
+    def test_unranked_and_unknown(self):
+        """
+        Users without invitees had no rank and unknown codes were rejected.
+        """
+        response = self.client.get("/api/leaderboard/", {"ref": self.refs(3)[0]})
+        self.assertIsNone(response.data["rank"])
+        response = self.client.get("/api/leaderboard/", {"ref": "zzzzzz"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get("/api/leaderboard/", {"limit": 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_referral_updates_ranking(self):
+        """
+        A registered referral moved the inviter up without a rebuild.
+        """
+        invitee = User.objects.create_user(username="59999999999")
+        token = Token.objects.create(user=invitee)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        ref = self.refs(0)[0]
+        for _ in range(2):
+            self.client.post("/api/data/", {"ref_code": ref})
+            User.objects.filter(pk=invitee.pk).update(inviter=None)
+            invitee.refresh_from_db()
+            get_token_cache().delete(token.key)
+        cache.clear()
+        response = self.client.get("/api/leaderboard/", {"ref": ref})
+        self.assertEqual((response.data["count"], response.data["rank"]), (5, 1))
+        self.assertEqual([e["rank"] for e in response.data["top"]], [1, 1, 3])
+
+class ConcurrentActivationTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("In-memory SQLite fails concurrent writes instead of waiting.")
+
+    def test_one_activation_wins(self):
+        """
+        Of parallel activations for one user exactly one was registered.
+        """
+        invitee = User.objects.create_user(username="60000000000")
+        inviters = [User.objects.create_user(username=f"6100000000{i}") for i in range(4)]
+        barrier = threading.Barrier(len(inviters))
+        results = []
+
+        def activate(inviter):
+            user = User.objects.get(pk=invitee.pk)
+            barrier.wait()
+            try:
+                results.append(referrals.activate(user, inviter.ref))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=activate, args=(i,)) for i in inviters]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(referrals.ACTIVATED), 1)
+        self.assertEqual(results.count(referrals.ALREADY_INVITED), len(inviters) - 1)
+        invitee.refresh_from_db()
+        counts = dict(User.objects.filter(
+            pk__in=[i.pk for i in inviters]
+        ).values_list("ref", "invitee_count"))
+        self.assertEqual(counts.pop(invitee.inviter_id), 1)
+        self.assertEqual(set(counts.values()), {0})
+
+    def test_mutual_activations(self):
+        """
+        Of two users registering each other's code in parallel at most
+        one succeeded.
+        """
+        users = [User.objects.create_user(username=f"6200000000{i}") for i in range(2)]
+        barrier = threading.Barrier(2)
+        results = []
+
+        def activate(user, inviter):
+            user = User.objects.get(pk=user.pk)
+            barrier.wait()
+            try:
+                results.append(referrals.activate(user, inviter.ref))
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=activate, args=pair) for pair in (users, users[::-1])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [referrals.ACTIVATED, referrals.CYCLE])
+        self.assertEqual(User.objects.filter(inviter__isnull=False).count(), 1)
+
+    def test_long_cycle(self):
+        """
+        Of two parallel activations that together closed a cycle of four
+        users at most one succeeded.
+        """
+        users = [User.objects.create_user(username=f"6200000001{i}") for i in range(4)]
+        referrals.activate(users[0], users[1].ref)
+        referrals.activate(users[2], users[3].ref)
+        barrier = threading.Barrier(2)
+        results = []
+
+        def activate(user, inviter):
+            user = User.objects.get(pk=user.pk)
+            barrier.wait()
+            try:
+                results.append(referrals.activate(user, inviter.ref))
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=activate, args=pair)
+            for pair in ((users[1], users[2]), (users[3], users[0]))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [referrals.ACTIVATED, referrals.CYCLE])
+        self.assertEqual(User.objects.filter(inviter__isnull=False).count(), 3)
+
+class SlowEventWriterTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("In-memory SQLite fails concurrent writes instead of waiting.")
+
+    def test_cursor_waits_for_slow_commit(self):
+        """
+        An event committed after a later activation started was served
+        before that activation's event, and nothing was served while the
+        first was still open.
+        """
+        inviter = User.objects.create_user(username="63000000000")
+        slow, fast = (User.objects.create_user(username=f"6300000000{i}") for i in (1, 2))
+        recorded, release = threading.Event(), threading.Event()
+        record = events.record
+
+        def slow_record(user, *args):
+            record(user, *args)
+            if user.pk == slow.pk:
+                recorded.set()
+                release.wait(5)
+
+        def activate(user):
+            try:
+                referrals.activate(User.objects.get(pk=user.pk), inviter.ref)
+            finally:
+                connection.close()
+
+        with mock.patch("api.events.record", side_effect=slow_record):
+            threads = [threading.Thread(target=activate, args=(slow,))]
+            threads[0].start()
+            recorded.wait(5)
+            threads.append(threading.Thread(target=activate, args=(fast,)))
+            threads[1].start()
+            time.sleep(0.2)
+            self.assertEqual(events.poll(0, 10), [])
+            release.set()
+            for thread in threads:
+                thread.join()
+        feed = events.poll(0, 10)
+        self.assertEqual([e["invitee"] for e in feed], [slow.username, fast.username])
+        self.assertEqual([e["count"] for e in feed], [1, 2])
+
+class ConcurrentLoginTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("In-memory SQLite fails concurrent writes instead of waiting.")
+
+    def test_one_user_created(self):
+        """
+        Parallel first logins of a phone number shared one user and token.
+        """
+        barrier = threading.Barrier(4)
+        results = []
+
+        def log_in():
+            barrier.wait()
+            try:
+                results.append(accounts.log_in("60000000000"))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=log_in) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({key for key, _ in results}), 1)
+        self.assertEqual([created for _, created in results].count(True), 1)
+        self.assertEqual(User.objects.filter(username="60000000000").count(), 1)
+
+class ExportReferralsCommandTests(TestCase):
+    def setUp(self):
+        self.inviter = User.objects.create_user(username="70000000000")
+        self.invitee = User.objects.create_user(username="70000000001")
+        self.other = User.objects.create_user(username="70000000002")
+        referrals.activate(self.invitee, self.inviter.ref)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def export(self, name, *args):
+        path = Path(self.tmp.name) / name
+        call_command("export_referrals", path, "--overlap", "0", *args, stdout=StringIO())
+        return path
+
+    def test_csv_and_gzip_ndjson(self):
+        """
+        The graph was exported as CSV and as compressed NDJSON.
+        """
+        path = self.export("graph.csv", "--chunk-size", "2")
+        self.assertEqual(path.read_text().splitlines(), [
+            "username,ref,invited,deleted",
+            f"70000000000,{self.inviter.ref},,",
+            f"70000000001,{self.invitee.ref},{self.inviter.ref},",
+            f"70000000002,{self.other.ref},,",
+        ])
+        path = self.export("graph.ndjson.gz")
+        with gzip.open(path, "rt") as source:
+            records = [json.loads(line) for line in source]
+        self.assertEqual(records[1], {
+            "username": "70000000001", "ref": self.invitee.ref, "invited": self.inviter.ref,
+            "deleted": False
+        })
+
+    def test_incremental_columnar(self):
+        """
+        An incremental export held only the users changed since the last run.
+        """
+        path = self.export("graph.bin", "--chunk-size", "2")
+        with path.open("rb") as source:
+            groups = list(export.read_columnar(source))
+        self.assertEqual([len(group) for group in groups], [2, 1])
+        referrals.activate(self.other, self.inviter.ref)
+        self.export("graph.bin", "--incremental")
+        with path.open("rb") as source:
+            rows = [row for group in export.read_columnar(source) for row in group]
+        self.assertEqual(sorted(rows), [
+            ("70000000000", self.inviter.ref, "", ""),
+            ("70000000002", self.other.ref, self.inviter.ref, ""),
+        ])
+
+    def test_incremental_tombstones(self):
+        """
+        Users deleted since the last run were exported as tombstones ahead
+        of the changed users, and not exported again by the next run.
+        """
+        path = self.export("graph.csv")
+        self.inviter.delete()
+        self.export("graph.csv", "--incremental")
+        self.assertEqual(path.read_text().splitlines(), [
+            "username,ref,invited,deleted",
+            f"70000000000,{self.inviter.ref},,1",
+            f"70000000001,{self.invitee.ref},,",
+        ])
+        self.export("graph.csv", "--incremental")
+        self.assertEqual(path.read_text().splitlines(), ["username,ref,invited,deleted"])
+
+    def test_incremental_overlap(self):
+        """
+        A change committed after the last run but stamped before it was
+        exported by the overlap of the next run.
+        """
+        path = self.export("graph.csv")
+        state = json.loads(path.with_name("graph.csv.state").read_text())
+        late = parse_datetime(state["until"]) - timedelta(seconds=10)
+        User.objects.filter(pk=self.other.pk).update(inviter=self.invitee.ref, modified=late)
+        call_command("export_referrals", path, "--incremental", stdout=StringIO())
+        self.assertEqual(path.read_text().splitlines(), [
+            "username,ref,invited,deleted",
+            f"70000000000,{self.inviter.ref},,",
+            f"70000000001,{self.invitee.ref},{self.inviter.ref},",
+            f"70000000002,{self.other.ref},{self.invitee.ref},",
+        ])
+
+class LoadtestCommandTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refcodes.allocator.next = refcodes.allocator.end = 0
+        self.subscriber = User.objects.create_user(username="79901234567")
+
+    def test_requires_dedicated_database(self):
+        """
+        The command refused to touch a database not marked for load tests.
+        """
+        with self.assertRaisesMessage(CommandError, "--i-know"):
+            call_command("loadtest", users=10, signups=0, reads=0, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 1)
+
+    @override_settings(LOADTEST_DATABASE=True)
+    def test_seed_and_cleanup(self):
+        """
+        Seeded users got unassigned numbers and tokens, and the cleanup
+        deleted them without touching real subscribers.
+        """
+        command = LoadtestCommand()
+        refs, tokens = command.seed(50, 0.8, 3.0, random.Random(1))
+        seeded = User.objects.filter(username__startswith=loadtest.SEED_PREFIX)
+        self.assertEqual(seeded.count(), 50)
+        self.assertEqual(len(tokens), 50)
+        self.assertEqual(set(seeded.values_list("ref", flat=True)), set(refs))
+        command.cleanup()
+        self.assertFalse(seeded.exists())
+        self.assertEqual(list(User.objects.values_list("username", flat=True)), ["79901234567"])
+        call_command("loadtest", users=20, signups=0, reads=0, stdout=StringIO())
+        self.assertEqual(list(User.objects.values_list("username", flat=True)), ["79901234567"])
+
+    def test_bench_requires_dedicated_database(self):
+        """
+        The benchmark commands refused to create their user in a database not
+        marked for load tests.
+        """
+        with self.assertRaisesMessage(CommandError, "--i-know"):
+            call_command("bench_async", requests=1, stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "--i-know"):
+            call_command("bench_connections", requests=1, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 1)
+
+    @override_settings(LOADTEST_DATABASE=True)
+    def test_bench_async_cleanup(self):
+        """
+        The benchmark logged in an unassigned number and left neither the
+        user, its codes nor a deletion tombstone behind.
+        """
+        call_command(
+            "bench_async", requests=2, concurrency=2, threads=1, delay=0,
+            stdout=StringIO(),
+        )
+        self.assertTrue(bench_async.BENCH_PHONE.startswith(loadtest.SIGNUP_PREFIX))
+        self.assertEqual(list(User.objects.values_list("username", flat=True)), ["79901234567"])
+        self.assertFalse(OneTimeCode.objects.exists())
+        self.assertFalse(DeletedUser.objects.exists())
+
+class ThrottlingTests(APITestCase):
+    @override_settings(THROTTLE_RATES={"login-phone": "2/min"})
+    def test_login_phone_limit(self):
+        """
+        Logins for one phone number were throttled above the rate.
+        """
+        for _ in range(2):
+            response = self.client.post("/api/login/", {"phone": "72222222222"})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post("/api/login/", {"phone": "72222222222"})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", response)
+        response = self.client.post("/api/login/", {"phone": "72222222223"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(THROTTLE_RATES={"verify-ip": "2/min"}, THROTTLE_CACHE_ALIAS="default")
+    def test_verify_ip_limit_shared(self):
+        """
+        Verifications from one address were throttled through the shared store.
+        """
+        cache.clear()
+        for phone in ("72222222222", "72222222223"):
+            response = self.client.post("/api/verify/", {"phone": phone, "verify": "0000"})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post("/api/verify/", {"phone": "72222222224", "verify": "0000"})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(THROTTLE_RATES={"login-phone": "1/min"})
+    async def test_async_login_limit(self):
+        """
+        The async login view applied the same limits.
+        """
+        response = await self.async_client.post(
+            "/api/async/login/", {"phone": "72222222222"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = await self.async_client.post(
+            "/api/async/login/", {"phone": "72222222222"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(THROTTLE_RATES={"verify-ip": "2/min"})
+    def test_spoofed_forwarded_for(self):
+        """
+        A client could not dodge the address limit with its own
+        X-Forwarded-For header.
+        """
+        for i in range(2):
+            response = self.client.post(
+                "/api/verify/", {"phone": f"7222222222{i}", "verify": "0000"},
+                HTTP_X_FORWARDED_FOR=f"10.0.0.{i}"
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            "/api/verify/", {"phone": "72222222229", "verify": "0000"}, HTTP_X_FORWARDED_FOR="10.0.0.9"
+        )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_local_store_eviction(self):
+        """
+        A full local store dropped the least recently hit key.
+        """
+        store = throttling.LocalCounterStore(2)
+        for key in ("a:60", "b:60", "a:60", "c:60"):
+            store.hit(key, 60)
+        self.assertEqual(list(store.counters), ["a:60", "c:60"])
+
+    def test_sliding_window_estimate(self):
+        """
+        Requests of the previous window were weighted by their overlap.
+        """
+        store = throttling.LocalCounterStore(10)
+        with mock.patch("api.throttling.time.time", return_value=90):
+            for _ in range(4):
+                store.hit("key:60", 60)
+        with mock.patch("api.throttling.time.time", return_value=135):
+            self.assertEqual(store.hit("key:60", 60), 4 * 0.75 + 1)
+        with mock.patch("api.throttling.time.time", return_value=300):
+            self.assertEqual(store.hit("key:60", 60), 1)
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = routers.PrimaryReplicaRouter()
+        self.inviter = User.objects.create_user(username="80000000000")
+        self.user = User.objects.create_user(username="80000000001")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def test_router(self):
+        """
+        Only reads inside use_replicas() were sent to a replica.
+        """
+        self.assertEqual(self.router.db_for_read(User), "default")
+        with routers.use_replicas():
+            self.assertEqual(self.router.db_for_read(User), "replica")
+            self.assertEqual(self.router.db_for_write(User), "default")
+        self.assertEqual(self.router.db_for_read(User), "default")
+        self.assertFalse(self.router.allow_migrate("replica", "api"))
+        self.assertIsNone(self.router.allow_migrate("default", "api"))
+
+    def routed_reads(self, method, *args):
+        """
+        Send a request and collect whether each read went to a replica.
+        """
+        reads = []
+
+        def db_for_read(router, model, **hints):
+            reads.append(routers.replica_reads.get())
+            return "default"
+
+        with mock.patch.object(routers.PrimaryReplicaRouter, "db_for_read", db_for_read):
+            response = getattr(self.client, method)(*args)
+        self.assertLess(response.status_code, 400)
+        return reads
+
+    def test_reads_stick_to_primary_after_write(self):
+        """
+        Profile reads used the replica until the user registered a referral.
+        """
+        self.assertIn(True, self.routed_reads("get", "/api/data/tree/"))
+        self.assertNotIn(True, self.routed_reads("post", "/api/data/", {"ref_code": self.inviter.ref}))
+        self.assertNotIn(True, self.routed_reads("get", "/api/data/tree/"))
+        cache.delete(f"replica-pin:{self.user.pk}")
+        self.assertIn(True, self.routed_reads("get", "/api/leaderboard/", {"ref": self.inviter.ref}))
+
+    def test_inviter_sticks_to_primary(self):
+        """
+        The inviter's profile was read from the primary after an invitee
+        registered their code, so its cached page counted the invitee.
+        """
+        self.routed_reads("post", "/api/data/", {"ref_code": self.inviter.ref})
+        token = Token.objects.create(user=self.inviter)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.assertNotIn(True, self.routed_reads("get", "/api/data/"))
+
+
+@skipUnless(len(settings.DATABASES) > 1, "No replica alias in DATABASES.")
+class ReplicaDatabaseTests(TransactionTestCase):
+    databases = "__all__"
+
+    def test_profile_read_from_replica(self):
+        """
+        Profile reads were sent to the configured replica database.
+        """
+        replica = next(alias for alias in settings.DATABASES if alias != "default")
+        user = User.objects.create_user(username="80000000002")
+        token = Token.objects.create(user=user)
+        with override_settings(DATABASE_REPLICAS=[replica]):
+            with CaptureQueriesContext(connections[replica]) as queries:
+                self.client.get("/api/data/tree/", headers={"Authorization": f"Token {token.key}"})
+        self.assertEqual(len(queries), 1)
+
+class ProfilesViewTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        admin = User.objects.create_user(username="90000000000", is_staff=True)
+        self.token = Token.objects.create(user=admin)
+        self.inviter = User.objects.create_user(username="90000000001")
+        for i in range(3):
+            invitee = User.objects.create_user(username=f"9000000001{i}")
+            referrals.activate(invitee, self.inviter.ref)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    @override_settings(PROFILES_INVITEES_LIMIT=2)
+    def test_bulk_lookup(self):
+        """
+        Profiles were resolved by phone and by code in a fixed number of queries.
+        """
+        data = {
+            "phones": ["9 000 000-00-01", "9 000 000-00-99"],
+            "refs": ["zzzzzz"],
+            "invitees": True,
+        }
+        with self.assertMaxQueries(3):
+            response = self.client.post("/api/profiles/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["profiles"], [{
+            "phone": "90000000001",
+            "ref": self.inviter.ref,
+            "invited": "",
+            "count": 3,
+            "users": ["90000000010", "90000000011"],
+        }])
+        self.assertEqual(response.data["missing"], ["9 000 000-00-99", "zzzzzz"])
+        refs = list(User.objects.filter(inviter_id=self.inviter.ref).values_list("ref", flat=True))
+        response = self.client.post("/api/profiles/", {"refs": refs}, format="json")
+        self.assertEqual([p["invited"] for p in response.data["profiles"]], [self.inviter.ref] * 3)
+
+    @override_settings(PROFILES_MAX_LOOKUPS=1)
+    def test_limits_and_permissions(self):
+        """
+        Oversized lookups and lookups by non-staff users were rejected.
+        """
+        response = self.client.post("/api/profiles/", {"refs": ["a", "b"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        token = Token.objects.create(user=self.inviter)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        response = self.client.post("/api/profiles/", {"refs": ["a"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+@override_settings(EVENTS_POLL_INTERVAL=0.01)
+class EventsFeedTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username="90000000000", is_staff=True)
+        self.token = Token.objects.create(user=self.admin)
+        self.inviter = User.objects.create_user(username="90000000001")
+        self.invitees = [User.objects.create_user(username=f"9000000001{i}") for i in range(3)]
+        for invitee in self.invitees:
+            referrals.activate(invitee, self.inviter.ref)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_feed_pages(self):
+        """
+        The events were read in order, one page per cursor, in one query each.
+        """
+        with self.assertMaxQueries(2):
+            response = self.client.get("/api/events/", {"limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        events = response.data["events"]
+        self.assertEqual([e["invitee"] for e in events], ["90000000010", "90000000011"])
+        self.assertEqual([e["count"] for e in events], [1, 2])
+        self.assertEqual(events[0]["inviter"], self.inviter.ref)
+        self.assertEqual(events[0]["invitee_ref"], self.invitees[0].ref)
+        response = self.client.get("/api/events/", {"after": response.data["next"]})
+        self.assertEqual([e["invitee"] for e in response.data["events"]], ["90000000012"])
+        after = response.data["next"]
+        response = self.client.get("/api/events/", {"after": after, "wait": 0.05})
+        self.assertEqual(response.data, {"events": [], "next": after})
+
+    def test_event_in_activation_transaction(self):
+        """
+        A referral whose event could not be written was rolled back, and
+        a failed activation left no event.
+        """
+        invitee = User.objects.create_user(username="90000000020")
+        with mock.patch("api.events.record", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                referrals.activate(invitee, self.inviter.ref)
+        invitee.refresh_from_db()
+        self.assertIsNone(invitee.inviter_id)
+        self.inviter.refresh_from_db()
+        self.assertEqual(self.inviter.invitee_count, 3)
+        with mock.patch("api.leaderboard.move", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                referrals.activate(invitee, self.inviter.ref)
+        self.assertFalse(ReferralEvent.objects.filter(invitee=invitee.username).exists())
+
+    def test_admin_only(self):
+        """
+        The feed was refused to regular users and to invalid parameters.
+        """
+        response = self.client.get("/api/events/", {"wait": 1000})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/api/events/", {"wait": 10})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        token = Token.objects.create(user=self.inviter)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        response = self.client.get("/api/events/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_async_feed(self):
+        """
+        The async feed served the same events.
+        """
+        headers = {"Authorization": f"Token {self.token.key}"}
+        response = await self.async_client.get(
+            "/api/async/events/", {"after": 1, "wait": 10}, headers=headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = await sync_to_async(list)(ReferralEvent.objects.order_by("pk").values_list("pk", flat=True))
+        self.assertEqual([e["id"] for e in response.json()["events"]], [i for i in ids if i > 1])
+
+class SchemaTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(SCHEMA_ARTIFACT_DIR=self.tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_build_and_serve(self):
+        """
+        The built schema was served gzipped or plain without regenerating it.
+        """
+        call_command("build_schema", stdout=StringIO())
+        self.assertEqual(len(list(Path(self.tmp.name).glob("openapi-*.gz"))), 2)
+        with mock.patch("api.schema.build") as build, self.assertMaxQueries(0):
+            response = self.client.get("/api/swagger.json/", HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            plain = self.client.get("/api/swagger.json/")
+            cache.clear()
+            self.client.get("/api/swagger.yaml/")
+        build.assert_not_called()
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        spec = json.loads(plain.content)
+        self.assertEqual(spec["basePath"], "/api")
+        self.assertIn("/leaderboard/", spec["paths"])
+        response = self.client.get("/api/swagger.json/", HTTP_IF_NONE_MATCH=plain["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_first_request_builds(self):
+        """
+        A missing artifact was generated by the first request.
+        """
+        response = self.client.get("/api/swagger.json/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(list(Path(self.tmp.name).glob("openapi-*.json.gz"))), 1)
+        response = self.client.get("/api/swagger/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, "/api/swagger.json/")
+
+class StartupProfileTests(TestCase):
+    def test_api_settings(self):
+        """
+        The API-only profile dropped the admin, sessions, messages and docs,
+        and left the base settings unchanged.
+        """
+        api_settings = importlib.import_module("referral.settings_api")
+        for app in ("django.contrib.admin", "django.contrib.sessions", "drf_yasg"):
+            self.assertNotIn(app, api_settings.INSTALLED_APPS)
+        self.assertIn("api.apps.ApiConfig", api_settings.INSTALLED_APPS)
+        self.assertNotIn(
+            "django.contrib.sessions.middleware.SessionMiddleware", api_settings.MIDDLEWARE
+        )
+        messages = "django.contrib.messages.context_processors.messages"
+        self.assertNotIn(messages, api_settings.TEMPLATES[0]["OPTIONS"]["context_processors"])
+        base_settings = importlib.import_module("referral.settings")
+        self.assertIn(messages, base_settings.TEMPLATES[0]["OPTIONS"]["context_processors"])
+
+    def test_report(self):
+        """
+        Both applications were started in fresh interpreters and served a request.
+        """
+        out = StringIO()
+        call_command("startup_profile", runs=1, top=5, stdout=out)
+        report = json.loads(out.getvalue())["profiles"][os.environ["DJANGO_SETTINGS_MODULE"]]
+        for target in ("wsgi", "asgi"):
+            self.assertEqual(report[target]["status"], status.HTTP_401_UNAUTHORIZED)
+            self.assertGreater(report[target]["time_to_first_request_ms"], 0)
+            self.assertEqual(len(report[target]["slowest"]), 5)
+            self.assertGreater(report[target]["modules"], 100)
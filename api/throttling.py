@@ -0,0 +1,199 @@
+import threading, time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.throttling import BaseThrottle
+
+
+# Requests are counted in fixed windows, and the rate over the last
+# window length is estimated from the current and the previous window,
+# weighting the previous one by the part of it still inside the sliding
+# window. A key costs two counters whatever its request rate.
+
+DURATIONS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate):
+    """
+    Turn a rate like "5/min" into the request limit and window seconds.
+    """
+    num, period = rate.split("/")
+    return int(num), DURATIONS[period[0]]
+
+
+def estimate(previous, current, window, now):
+    elapsed = now % window / window
+    return previous * (1 - elapsed) + current
+
+
+class LocalCounterStore:
+    """
+    Window counters in the memory of the process.
+
+    When more than maxsize keys are tracked, the least recently hit key
+    is dropped.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.counters = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, key, window):
+        now = time.time()
+        index = int(now // window)
+        with self.lock:
+            last, previous, current = self.counters.pop(key, (index, 0, 0))
+            if last == index:
+                current += 1
+            else:
+                previous = current if last == index - 1 else 0
+                current = 1
+            self.counters[key] = (index, previous, current)
+            if len(self.counters) > self.maxsize:
+                self.counters.popitem(last=False)
+        return estimate(previous, current, window, now)
+
+    async def ahit(self, key, window):
+        return self.hit(key, window)
+
+
+class CacheCounterStore:
+    """
+    Window counters in a Django cache shared by all worker processes.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def keys(self, key, window, now):
+        index = int(now // window)
+        return f"throttle:{key}:{index}", f"throttle:{key}:{index - 1}"
+
+    def hit(self, key, window):
+        now = time.time()
+        current_key, previous_key = self.keys(key, window, now)
+        if self.cache.add(current_key, 1, window * 2):
+            current = 1
+        else:
+            current = self.cache.incr(current_key)
+        previous = self.cache.get(previous_key, 0)
+        return estimate(previous, current, window, now)
+
+    async def ahit(self, key, window):
+        now = time.time()
+        current_key, previous_key = self.keys(key, window, now)
+        if await self.cache.aadd(current_key, 1, window * 2):
+            current = 1
+        else:
+            current = await self.cache.aincr(current_key)
+        previous = await self.cache.aget(previous_key, 0)
+        return estimate(previous, current, window, now)
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        if settings.THROTTLE_CACHE_ALIAS:
+            _store = CacheCounterStore(settings.THROTTLE_CACHE_ALIAS)
+        else:
+            _store = LocalCounterStore(settings.THROTTLE_LOCAL_SIZE)
+    return _store
+
+
+def phone_ident(data):
+    phone = "".join(filter(str.isdigit, str(data.get("phone") or "")))
+    return phone if len(phone) == 11 else None
+
+
+def ip_ident(request):
+    """
+    The client address, taken from X-Forwarded-For only as far as
+    REST_FRAMEWORK["NUM_PROXIES"] trusted proxies set it.
+    """
+    return BaseThrottle().get_ident(request)
+
+
+def check(scope, ident):
+    """
+    Count a request of ident against the rate of scope in THROTTLE_RATES.
+
+    Return the seconds to wait when the rate is exceeded, otherwise None.
+    Scopes without a rate are not limited.
+    """
+    rate = settings.THROTTLE_RATES.get(scope)
+    if rate is None or ident is None:
+        return None
+    limit, window = parse_rate(rate)
+    if get_store().hit(f"{scope}:{ident}:{window}", window) <= limit:
+        return None
+    return window - time.time() % window
+
+
+async def acheck(scope, ident):
+    rate = settings.THROTTLE_RATES.get(scope)
+    if rate is None or ident is None:
+        return None
+    limit, window = parse_rate(rate)
+    if await get_store().ahit(f"{scope}:{ident}:{window}", window) <= limit:
+        return None
+    return window - time.time() % window
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Limit the requests of a view by the sliding window rate of the
+    "<throttle_scope>-<kind>" scope in THROTTLE_RATES.
+    """
+
+    kind = None
+
+    def __init__(self):
+        self.wait_time = None
+
+    def get_ident_key(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        scope = getattr(view, "throttle_scope", None)
+        if scope is None:
+            return True
+        self.wait_time = check(f"{scope}-{self.kind}", self.get_ident_key(request))
+        return self.wait_time is None
+
+    def wait(self):
+        return self.wait_time
+
+
+class PhoneThrottle(SlidingWindowThrottle):
+    """
+    Throttle by the phone number in the request body.
+    """
+
+    kind = "phone"
+
+    def get_ident_key(self, request):
+        return phone_ident(request.data)
+
+
+class IPThrottle(SlidingWindowThrottle):
+    """
+    Throttle by the client address.
+    """
+
+    kind = "ip"
+
+    def get_ident_key(self, request):
+        return ip_ident(request)
+
+
+@receiver(setting_changed)
+def reset_store(setting, **kwargs):
+    global _store
+    if setting.startswith("THROTTLE_"):
+        _store = None
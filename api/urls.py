@@ -1,29 +1,29 @@
+from django.apps import apps
 from django.urls import path
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
-from . import views
-
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Referral API",
-        default_version='v1',
-        description="Test project for Hammer Systems",
-        #terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="advixum@gmail.com"),
-        license=openapi.License(name="AGPL-3.0 license"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from . import async_views, schema, views
 
 app_name = 'api'
 
 urlpatterns = [
-    path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('login/', views.LoginView.as_view(), name='login'),
+    path('delivery/<str:ticket>/', views.DeliveryStatusView.as_view(), name='delivery-status'),
     path('verify/', views.VerifyView.as_view(), name='verify'),
+    path('token/rotate/', views.TokenRotateView.as_view(), name='token-rotate'),
     path('data/', views.DataView.as_view(), name='data'),
-]
\ No newline at end of file
+    path('data/tree/', views.ReferralTreeView.as_view(), name='data-tree'),
+    path('leaderboard/', views.LeaderboardView.as_view(), name='leaderboard'),
+    path('profiles/', views.ProfilesView.as_view(), name='profiles'),
+    path('events/', views.EventsView.as_view(), name='events'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+    path('async/login/', async_views.AsyncLoginView.as_view(), name='async-login'),
+    path('async/verify/', async_views.AsyncVerifyView.as_view(), name='async-verify'),
+    path('async/data/', async_views.AsyncDataView.as_view(), name='async-data'),
+    path('async/events/', async_views.AsyncEventsView.as_view(), name='async-events'),
+]
+
+if apps.is_installed('drf_yasg'):
+    urlpatterns += [
+        path('swagger<format>/', schema.SchemaFileView.as_view(), name='schema-json'),
+        path('swagger/', schema.ui_view('swagger'), name='schema-swagger-ui'),
+        path('redoc/', schema.ui_view('redoc'), name='schema-redoc'),
+    ]
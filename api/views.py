@@ -1,49 +1,41 @@
-import random, time
-from django.shortcuts import get_object_or_404
-from drf_yasg import openapi
-from drf_yasg.utils import swagger_auto_schema
+import json, random
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.http import StreamingHttpResponse
+from django.utils.http import parse_etags
 from rest_framework import status
-from rest_framework.authtoken.models import Token
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from . import accounts, events, idempotency, leaderboard, otp, profiles, profiling, referrals
+from .delivery import get_backend
+from .routers import ReplicaReadMixin
+from .throttling import IPThrottle, PhoneThrottle
 from .models import User
 
 
 # Create your views here.
+# Their OpenAPI descriptions are in docs.py.
+
+ACTIVATION_ERRORS = {
+    referrals.ALREADY_INVITED: (
+        "You cannot modify a registered referral code.", status.HTTP_400_BAD_REQUEST
+    ),
+    referrals.NOT_FOUND: ("No such code exists.", status.HTTP_404_NOT_FOUND),
+    referrals.SELF_INVITE: ("You cannot invite yourself.", status.HTTP_400_BAD_REQUEST),
+    referrals.CYCLE: (
+        "You cannot register a code of a user you invited.", status.HTTP_400_BAD_REQUEST
+    ),
+}
 
 class LoginView(APIView):
     """
     Log in using phone number and receive a verification code.
     """
+    throttle_classes = [IPThrottle, PhoneThrottle]
+    throttle_scope = "login"
 
-    SuccessResponseSchema = openapi.Schema(
-        type="object",
-        properties={
-            "phone": openapi.Schema(type="string"),
-            "code": openapi.Schema(type="string")
-        }
-    )
-    FailedResponseSchema = openapi.Schema(
-        type="object",
-        properties={
-            "message": openapi.Schema(type="string")
-        }
-    )
-
-    @swagger_auto_schema(
-        request_body=openapi.Schema(
-            type="object",
-            properties={
-                "phone": openapi.Schema(type="string", description="Phone number"),
-            },
-            required=["phone"],
-        ),
-        responses={
-            200: openapi.Response(description="Successful response", schema=SuccessResponseSchema),
-            400: openapi.Response(description="Bad Request", schema=FailedResponseSchema),
-        },
-    )
     def post(self, request):
         input_phone = request.data.get("phone")
         phone = "".join(filter(str.isdigit, input_phone))
@@ -53,187 +45,329 @@ class LoginView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         code = str(random.randint(1, 9999)).zfill(4)
+        otp.get_store().issue(phone, code)
+        ticket = get_backend().submit(phone, code)
         data = {
             "phone": phone,
-            "code": code
+            "ticket": ticket
+        }
+        if settings.OTP_EXPOSE_CODE:
+            data["code"] = code
+        return Response(data, status=status.HTTP_200_OK)
+
+class DeliveryStatusView(APIView):
+    """
+    Check whether the verification code of a login ticket was sent.
+    """
+
+    def get(self, request, ticket):
+        delivery = get_backend().status(ticket)
+        if delivery is None:
+            return Response(
+                {"message": "Ticket not found."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        data = {
+            "ticket": ticket,
+            "status": delivery["status"],
+            "sent_at": delivery["sent_at"]
         }
-        time.sleep(2)
         return Response(data, status=status.HTTP_200_OK)
 
 class VerifyView(APIView):
     """
     Verify the phone number using the received code.
     """
+    throttle_classes = [IPThrottle, PhoneThrottle]
+    throttle_scope = "verify"
 
-    SuccessResponseSchema = openapi.Schema(
-        type="object",
-        properties={
-            "message": openapi.Schema(type="string"),
-            "token": openapi.Schema(type="string")
-        }
-    )
-    FailedResponseSchema = openapi.Schema(
-        type="object",
-        properties={
-            "message": openapi.Schema(type="string")
-        }
-    )
-
-    @swagger_auto_schema(
-        request_body=openapi.Schema(
-            type="object",
-            properties={
-                "phone": openapi.Schema(type="string", description="Phone number"),
-                "code": openapi.Schema(type="string", description="SMS code"),
-                "verify": openapi.Schema(type="string", description="Verification code"),
-            },
-            required=["phone", "code", "verify"],
-        ),
-        responses={
-            200: openapi.Response(description="Successful response", schema=SuccessResponseSchema),
-            201: openapi.Response(description="Successful response", schema=SuccessResponseSchema),
-            400: openapi.Response(description="Bad Request", schema=FailedResponseSchema),
-        },
-    )
     def post(self, request):
         input_phone = request.data.get("phone")
         phone_num = "".join(filter(str.isdigit, input_phone))
-        code = request.data.get("code")
         verify = request.data.get("verify")
-        if len(phone_num) != 11 or code != verify:
-            error = "Invalid code."
+        if len(phone_num) != 11:
             return Response(
-                {"message": error},
+                {"message": "Invalid code."},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        try:
-            current_user = User.objects.get(username=phone_num)
-            token, _ = Token.objects.get_or_create(user=current_user)
+        # Every guess is counted by the store first. A retry of a verified
+        # request finds its code used, and gets the stored response with
+        # the token of the user, as long as that token was not replaced.
+        result = otp.get_store().verify(phone_num, verify)
+        replay_key = idempotency.make_key("verify", request, phone_num, verify)
+        if result == otp.MISSING:
+            replay = idempotency.lookup(replay_key)
+            token = replay and accounts.replay_token(phone_num, replay[0]["token"])
+            if token:
+                data, status_code = replay
+                return Response(
+                    {**data, "token": token}, status=status_code,
+                    headers={idempotency.REPLAYED_HEADER: "true"}
+                )
+        if result == otp.EXPIRED:
+            return Response(
+                {"message": "Code expired."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if result == otp.LOCKED:
             return Response(
-                {"message": "Login successful.", "token": token.key},
-                status=status.HTTP_200_OK
+                {"message": "Too many attempts. Request a new code."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
             )
-        except User.DoesNotExist:
-            current_user = User(username=phone_num)
-            current_user.save()
-            token = Token.objects.create(user=current_user)
+        if result != otp.VALID:
             return Response(
-                {"message": "User created and logged in.", "token": token.key},
-                status=status.HTTP_201_CREATED
+                {"message": "Invalid code."},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        token, created = accounts.log_in(phone_num)
+        if created:
+            message, status_code = "User created and logged in.", status.HTTP_201_CREATED
+        else:
+            message, status_code = "Login successful.", status.HTTP_200_OK
+        idempotency.remember(
+            replay_key, {"message": message, "token": idempotency.fingerprint(token)}, status_code
+        )
+        return Response({"message": message, "token": token}, status=status_code)
 
-class DataView(APIView):
+class TokenRotateView(APIView):
+    """
+    Replace the token of the request with a new one.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        token = accounts.rotate(request.auth)
+        if token is None:
+            return Response(
+                {"message": "Token was already replaced."},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(
+            {"message": "Token replaced.", "token": token},
+            status=status.HTTP_200_OK
+        )
+
+class DataView(ReplicaReadMixin, APIView):
     """
     View and manage user data.
     """
     permission_classes = [IsAuthenticated]
 
-    SuccessGetResponseSchema = openapi.Schema(
-        type="object",
-        properties={
-            "users": openapi.Schema(type="array", items=openapi.Schema(type="string")),
-            "ref": openapi.Schema(type="string"),
-            "invited": openapi.Schema(type="string")
-        }
-    )
-    FailedGetResponseSchema = openapi.Schema(
-        type="object",
-        properties={
-            "message": openapi.Schema(type="string")
-        }
-    )
-
-    @swagger_auto_schema(
-        responses={
-            200: openapi.Response(description="Successful response", schema=SuccessGetResponseSchema),
-            404: openapi.Response(description="Not Found", schema=FailedGetResponseSchema),
-        },
-    )
     def get(self, request):
-        user = request.user
+        user_instance = request.user
+        invited_value = user_instance.inviter_id or ""
+        ref_value = user_instance.ref
+        invited_users = User.objects.filter(
+            inviter_id=ref_value
+        ).order_by("username").values_list("username", flat=True)
+        if request.query_params.get("count_only") in ("1", "true"):
+            data = {
+                "ref": ref_value,
+                "invited": invited_value,
+                "count": user_instance.invitee_count
+            }
+            return Response(data, status=status.HTTP_200_OK)
+        if request.query_params.get("stream") in ("1", "true"):
+            # The stream is read after the view returns, outside the
+            # replica routing, so its database is fixed here.
+            invited_users = invited_users.using(invited_users.db)
+            return StreamingHttpResponse(
+                (json.dumps(i) + "\n" for i in invited_users.iterator(chunk_size=2000)),
+                content_type="application/x-ndjson"
+            )
         try:
-            user_instance = get_object_or_404(User, username=user.username)
-        except User.DoesNotExist:
+            limit = int(request.query_params.get("limit", settings.DATA_PAGE_SIZE))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= settings.DATA_MAX_PAGE_SIZE:
             return Response(
-                {"message": "User not found"}, 
-                status=status.HTTP_404_NOT_FOUND
+                {"message": f"Limit must be between 1 and {settings.DATA_MAX_PAGE_SIZE}."},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        invited_value = user_instance.invited
-        ref_value = user_instance.ref
-        invited_users = User.objects.filter(invited=ref_value)
-        invited_data = [i.username for i in invited_users]
-        data = {
-            "users": invited_data,
-            "ref": ref_value,
-            "invited": invited_value
-        }
-        return Response(data, status=status.HTTP_200_OK)
+        after = request.query_params.get("after")
+        cache_key = profiles.profile_key(user_instance.pk, f"{limit}:{after or ''}")
+        cached = profiles.get_profile(cache_key)
+        if cached is None:
+            if after:
+                invited_users = invited_users.filter(username__gt=after)
+            invited_data = list(invited_users[:limit + 1])
+            next_cursor = invited_data[limit - 1] if len(invited_data) > limit else None
+            cached = profiles.set_profile(
+                cache_key, {"users": invited_data[:limit], "next": next_cursor}
+            )
+        data, etag = profiles.profile_data(user_instance, *cached)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(data, status=status.HTTP_200_OK, headers={"ETag": etag})
 
-    SuccessResponseSchema = openapi.Schema(
-        type="object",
-        properties={
-            "message": openapi.Schema(type="string"),
-            "invited": openapi.Schema(type="string")
-        }
-    )
-    FailedResponseSchema = openapi.Schema(
-        type="object",
-        properties={
-            "message": openapi.Schema(type="string")
-        }
-    )
-
-    @swagger_auto_schema(
-        request_body=openapi.Schema(
-            type="object",
-            properties={
-                "ref_code": openapi.Schema(type="string", description="Referral code"),
-            },
-            required=["ref_code"],
-        ),
-        responses={
-            200: openapi.Response(description="Successful response", schema=SuccessResponseSchema),
-            400: openapi.Response(description="Bad Request", schema=FailedGetResponseSchema),
-            404: openapi.Response(description="Not Found", schema=FailedGetResponseSchema),
-        },
-    )
     def post(self, request):
-        user = request.user
+        user_instance = request.user
         ref_code = request.data.get("ref_code")
         if not ref_code:
             return Response(
                 {"message": "Referral code is required."}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+        result = referrals.activate(user_instance, ref_code)
+        if result != referrals.ACTIVATED:
+            message, status_code = ACTIVATION_ERRORS[result]
+            return Response({"message": message}, status=status_code)
+        data = {
+            "message": f"Referral code {ref_code} successfully registered.",
+            "invited": ref_code,
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+class ReferralTreeView(ReplicaReadMixin, APIView):
+    """
+    View the referrals of the user down to several levels.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
         try:
-            user_instance = User.objects.get(username=user.username)
-        except User.DoesNotExist:
+            depth = int(request.query_params.get("depth", settings.TREE_MAX_DEPTH))
+            limit = int(request.query_params.get("limit", settings.DATA_PAGE_SIZE))
+        except ValueError:
+            depth = limit = 0
+        if not 0 < depth <= settings.TREE_MAX_DEPTH:
             return Response(
-                {"message": "User not found."}, 
-                status=status.HTTP_404_NOT_FOUND
+                {"message": f"Depth must be between 1 and {settings.TREE_MAX_DEPTH}."},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        if user_instance.invited != "":
+        if not 0 < limit <= settings.DATA_MAX_PAGE_SIZE:
             return Response(
-                {"message": "You cannot modify a registered referral code."}, 
+                {"message": f"Limit must be between 1 and {settings.DATA_MAX_PAGE_SIZE}."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        data = referrals.subtree(request.user, depth, limit)
+        return Response(data, status=status.HTTP_200_OK)
+
+class LeaderboardView(ReplicaReadMixin, APIView):
+    """
+    View the top referrers and the rank of a user among them.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
         try:
-            ref_check = User.objects.get(ref=ref_code)
-        except User.DoesNotExist:
+            limit = int(request.query_params.get("limit", settings.LEADERBOARD_SIZE))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= settings.LEADERBOARD_MAX_SIZE:
             return Response(
-                {"message": "No such code exists."},
-                status=status.HTTP_404_NOT_FOUND
+                {"message": f"Limit must be between 1 and {settings.LEADERBOARD_MAX_SIZE}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        ref_value = request.query_params.get("ref") or request.user.ref
+        if ref_value == request.user.ref:
+            score = request.user.invitee_count
+        else:
+            score = User.objects.filter(ref=ref_value).values_list(
+                "invitee_count", flat=True
+            ).first()
+            if score is None:
+                return Response(
+                    {"message": "No such code exists."},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+        data = {
+            "top": leaderboard.top(limit),
+            "ref": ref_value,
+            "count": score,
+            "rank": leaderboard.rank(score)
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+class ProfilesView(ReplicaReadMixin, APIView):
+    """
+    Look up the referral data of many users at once, for internal services.
+    """
+    permission_classes = [IsAdminUser]
+    replica_methods = ("POST",)
+
+    def post(self, request):
+        phones = request.data.get("phones") or []
+        refs = request.data.get("refs") or []
+        if not all(isinstance(value, list) for value in (phones, refs)):
+            return Response(
+                {"message": "Phones and refs must be lists."},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        if ref_code == user_instance.ref:
+        if len(phones) + len(refs) > settings.PROFILES_MAX_LOOKUPS:
             return Response(
-                {"message": "You cannot invite yourself."},
+                {"message": f"At most {settings.PROFILES_MAX_LOOKUPS} phones and refs are allowed."},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        user_instance.invited = ref_code
-        user_instance.save()
+        digits = {str(phone): "".join(filter(str.isdigit, str(phone))) for phone in phones}
+        refs = [str(ref) for ref in refs]
+        users = list(User.objects.filter(
+            Q(username__in=set(digits.values())) | Q(ref__in=refs)
+        ).order_by("username").values_list("username", "ref", "inviter_id", "invitee_count"))
+        invitees = {}
+        if request.data.get("invitees") in (True, "true", "1"):
+            rows = User.objects.filter(
+                inviter_id__in=[ref for _, ref, _, count in users if count]
+            ).annotate(position=Window(
+                RowNumber(), partition_by=F("inviter_id"), order_by=F("username").asc()
+            )).filter(
+                position__lte=settings.PROFILES_INVITEES_LIMIT
+            ).order_by("inviter_id", "username").values_list("inviter_id", "username")
+            for inviter, username in rows:
+                invitees.setdefault(inviter, []).append(username)
+        found_phones = {username for username, _, _, _ in users}
+        found_refs = {ref for _, ref, _, _ in users}
         data = {
-            "message": f"Referral code {ref_code} successfully registered.",
-            "invited": ref_code,
+            "profiles": [
+                {
+                    "phone": username,
+                    "ref": ref,
+                    "invited": inviter or "",
+                    "count": count,
+                    "users": invitees.get(ref, [])
+                }
+                for username, ref, inviter, count in users
+            ],
+            "missing": [
+                phone for phone, value in digits.items() if value not in found_phones
+            ] + [ref for ref in refs if ref not in found_refs]
         }
         return Response(data, status=status.HTTP_200_OK)
-    
+
+class EventsView(ReplicaReadMixin, APIView):
+    """
+    Read registered referrals in order, for internal services.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # Waiting holds a worker thread, so long polls belong on the async feed.
+        params = events.parse_params(request.query_params, settings.EVENTS_SYNC_MAX_WAIT)
+        if isinstance(params, str):
+            return Response({"message": params}, status=status.HTTP_400_BAD_REQUEST)
+        after, limit, wait = params
+        data = events.poll(after, limit, wait)
+        return Response(
+            {"events": data, "next": data[-1]["id"] if data else after},
+            status=status.HTTP_200_OK
+        )
+
+class MetricsView(APIView):
+    """
+    View request profiling histograms and switch profiling on or off.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        data = {
+            "enabled": profiling.switch.is_enabled(),
+            "endpoints": profiling.metrics.snapshot()
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        if "enabled" in request.data:
+            profiling.switch.set(request.data["enabled"] in (True, "true", "1"))
+        if request.data.get("reset") in (True, "true", "1"):
+            profiling.metrics.reset()
+        return self.get(request)
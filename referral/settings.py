@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +85,25 @@ WSGI_APPLICATION = 'referral.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Connections are kept open for DB_CONN_MAX_AGE seconds and checked before
+# reuse when DB_CONN_HEALTH_CHECKS is on. With DB_POOL_MAX_SIZE above zero
+# they are taken from a psycopg 3 pool shared by the threads of the
+# process instead (Django 5.1+), which rules out persistent connections.
+# Under ASGI every request runs its sync code in a new thread, whose
+# persistent connection is never reused or closed, so they stay off by
+# default: ASGI deployments use the pool, and only WSGI deployments should
+# raise DB_CONN_MAX_AGE.
+
+DB_CONN_MAX_AGE = 0
+
+DB_CONN_HEALTH_CHECKS = True
+
+DB_POOL_MIN_SIZE = 2
+
+DB_POOL_MAX_SIZE = 0
+
+DB_POOL_TIMEOUT = 10
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -92,6 +112,33 @@ DATABASES = {
         'PASSWORD': 'my_secret_password',
         'HOST': '127.0.0.1',
         'PORT': '5432',
+        'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
+        'OPTIONS': {
+            'pool': {
+                'min_size': DB_POOL_MIN_SIZE,
+                'max_size': DB_POOL_MAX_SIZE,
+                'timeout': DB_POOL_TIMEOUT,
+            },
+        } if DB_POOL_MAX_SIZE else {},
+    }
+}
+
+DATABASE_ROUTERS = ['api.routers.PrimaryReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The default cache must be shared by all worker processes. Delivery
+# tickets, cached profile pages and their versions, authenticated tokens,
+# replica pins, idempotent responses and the profiling switch are kept in
+# it, so with a process-local backend a worker neither sees the entries
+# nor the invalidations of the others.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/0',
     }
 }
 
@@ -117,10 +164,50 @@ AUTH_USER_MODEL = "api.User"
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication', 
+        'api.authentication.CachedTokenAuthentication',
     ],
+    # Number of reverse proxies in front of the application. Client
+    # addresses are taken from X-Forwarded-For only behind them, so a
+    # header sent by the client cannot dodge the per-address limits.
+    'NUM_PROXIES': 0,
 }
 
+# Authenticated tokens are cached for TOKEN_CACHE_TTL seconds in the cache
+# named by TOKEN_CACHE_ALIAS, where a changed user is invalidated for all
+# processes sharing it. When it is None they are cached in the local memory
+# of each process, up to TOKEN_CACHE_SIZE tokens, and a change is only
+# invalidated in the writing process; the others serve the old user for up
+# to TOKEN_CACHE_TTL seconds.
+
+TOKEN_CACHE_TTL = 60
+
+TOKEN_CACHE_SIZE = 10000
+
+TOKEN_CACHE_ALIAS = 'default'
+
+# Tokens expire TOKEN_TTL seconds after their last refresh, or never when
+# it is None. A token in use is refreshed once per TOKEN_REFRESH_INTERVAL
+# seconds. prune_tokens deletes the expired ones.
+
+TOKEN_TTL = 30 * 86400
+
+TOKEN_REFRESH_INTERVAL = 86400
+
+# Sliding window limits of /api/login/ and /api/verify/ per phone number
+# and per client address. Counters are kept in local memory, or in the
+# cache named by THROTTLE_CACHE_ALIAS when it is set.
+
+THROTTLE_RATES = {
+    'login-phone': '5/min',
+    'login-ip': '60/min',
+    'verify-phone': '10/min',
+    'verify-ip': '120/min',
+}
+
+THROTTLE_CACHE_ALIAS = None
+
+THROTTLE_LOCAL_SIZE = 100000
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -147,6 +234,132 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = 'api:login'
 
+# Referral code allocation. Codes are sequence numbers permuted with
+# REF_CODE_KEY, which is set once and never changed: under another key
+# new codes would collide with issued ones. It is kept apart from
+# SECRET_KEY, so that one can be rotated, and holds the value SECRET_KEY
+# had when the first codes were issued.
+
+REF_CODE_KEY = 'django-insecure-2$ni8z$m$&^dt7b)xwr3e4^lb_of!4npj_j(gmsq774)4blurq'
+
+REF_CODE_BLOCK_SIZE = 100
+
+REF_CODE_RETRIES = 5
+
+# Invitee list pagination on /api/data/
+
+DATA_PAGE_SIZE = 100
+
+DATA_MAX_PAGE_SIZE = 1000
+
+# Deepest referral level served by /api/data/tree/
+
+TREE_MAX_DEPTH = 5
+
+# Referral event feed on /api/events/. Requests can wait up to
+# EVENTS_MAX_WAIT seconds for new events, which are checked every
+# EVENTS_POLL_INTERVAL seconds. The sync view holds a worker thread while
+# it waits, so it only accepts waits up to EVENTS_SYNC_MAX_WAIT.
+
+EVENTS_PAGE_SIZE = 100
+
+EVENTS_MAX_PAGE_SIZE = 1000
+
+EVENTS_MAX_WAIT = 30
+
+EVENTS_SYNC_MAX_WAIT = 1
+
+EVENTS_POLL_INTERVAL = 0.5
+
+# Marks a dedicated database that loadtest and the bench commands may fill
+# with generated users and clean up. Other databases need --i-know.
+
+LOADTEST_DATABASE = False
+
+# Aliases in DATABASES of read replicas. Reads of /api/data/, the tree,
+# the leaderboard and exports go to them, except for users that wrote in
+# the last REPLICA_PIN_SECONDS.
+
+DATABASE_REPLICAS = []
+
+REPLICA_PIN_SECONDS = 5
+
+# Top referrers on /api/leaderboard/, cached for LEADERBOARD_CACHE_TTL
+# seconds. refresh_leaderboard rebuilds the ranking.
+
+LEADERBOARD_SIZE = 10
+
+LEADERBOARD_MAX_SIZE = 100
+
+LEADERBOARD_CACHE_TTL = 60
+
+# Bulk lookups on /api/profiles/
+
+PROFILES_MAX_LOOKUPS = 1000
+
+PROFILES_INVITEES_LIMIT = 100
+
+# OpenAPI schema, built by build_schema or by the first request and kept
+# gzipped in SCHEMA_ARTIFACT_DIR and the default cache under a version
+# derived from the code, unless SCHEMA_VERSION is set.
+
+SCHEMA_VERSION = None
+
+SCHEMA_ARTIFACT_DIR = BASE_DIR / 'schema'
+
+SCHEMA_CACHE_TTL = 86400
+
+SWAGGER_SETTINGS = {
+    'SPEC_URL': ('api:schema-json', {'format': '.json'}),
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': ('api:schema-json', {'format': '.json'}),
+}
+
+# Request profiling, switched at runtime through /api/metrics/
+
+PROFILING_ENABLED = False
+
+PROFILING_REFRESH = 1
+
+# Cached /api/data/ responses
+
+PROFILE_CACHE_ALIAS = 'default'
+
+PROFILE_CACHE_TTL = 300
+
+# Verification code delivery
+
+SMS_DELIVERY_BACKEND = 'api.delivery.ThreadPoolBackend'
+
+SMS_SENDER = 'api.delivery.StubSender'
+
+SMS_DELIVERY_WORKERS = 4
+
+SMS_STUB_DELAY = 2
+
+SMS_TICKET_TTL = 300
+
+# One-time verification codes
+
+OTP_STORE = 'api.otp.DatabaseOTPStore'
+
+OTP_CACHE = 'default'
+
+OTP_TTL = 300
+
+OTP_MAX_ATTEMPTS = 5
+
+# Return the code in the /api/login/ response as well. Only for development
+# with the stub SMS sender, where the code is not delivered anywhere.
+OTP_EXPOSE_CODE = False
+
+# Responses of /api/verify/ requests sent with an Idempotency-Key header,
+# kept in the default cache and replayed to retries
+
+IDEMPOTENCY_TTL = 3600
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -0,0 +1,50 @@
+"""
+API-only settings for referral project.
+
+The admin, sessions, messages, static files and the schema documentation
+are left out, and responses are rendered as JSON only, so worker
+processes start and serve their first request sooner. Select it with
+DJANGO_SETTINGS_MODULE=referral.settings_api.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+
+SLIM_APPS = [
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'drf_yasg',
+]
+
+SLIM_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+]
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in SLIM_APPS]
+
+MIDDLEWARE = [item for item in MIDDLEWARE if item not in SLIM_MIDDLEWARE]
+
+# The star import shares the dicts of the base settings, so they are
+# copied rather than changed in place.
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        'OPTIONS': {
+            **TEMPLATES[0]['OPTIONS'],
+            'context_processors': [
+                processor for processor in TEMPLATES[0]['OPTIONS']['context_processors']
+                if processor != 'django.contrib.messages.context_processors.messages'
+            ],
+        },
+    },
+    *TEMPLATES[1:],
+]
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+}